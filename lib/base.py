@@ -1,20 +1,21 @@
 # coding: UTF8
 
-from smtplib import SMTP
-from email.mime.text import MIMEText
-from inspect import getmembers, isclass
-from sys import argv
-from urllib.parse import urlparse
-from os.path import join as path_join, dirname
-from lib.util import debug
-from socket import getfqdn
-from tempfile import gettempdir
+# Modules which are not needed for every run (e.g., for mailing) are
+# imported where used to keep startup fast.
 
-# see http://bugs.python.org/issue18557
-from email.utils import getaddresses
+from sys import argv, stderr
+from os.path import join as path_join, dirname, getmtime
+from time import time, sleep
+from functools import partial
+from lib.util import debug
 
 import strategies as strategies_module
-from lib.strategies import BaseStrategy, KNOWLEDGE_NONE
+from lib.strategies import BaseStrategy, BatchStrategy, KNOWLEDGE_NONE
+from lib.targets import (	parse_target, is_expandable, expand_target,
+							count_targets, MAX_TARGETS )
+from lib.breaker import CircuitBreaker
+from lib.schedule import RunIndex
+from lib.executor import CheckExecutor, CheckJob
 from lib.config import ConfigDict, OptionsDict
 
 class MeerkatMon():
@@ -28,20 +29,43 @@ class MeerkatMon():
 
 	configs = ConfigDict()
 
+	# section -> CheckResult of the last check (kept across runs)
+	results = dict()
+
+	# section -> CheckResult of the current periodic run (to be mailed)
+	run_results = dict()
+
+	# whether to mail results
+	mail = True
+
 	global_options = OptionsDict({
 		'mail_together': 'False',
-		'mail_from': 'meerkatmon@%s' % getfqdn(),
+		'mail_from': None,
 		'mail_threaded': 'True',
 		'mail_threaded_per_checking_host': 'False',
-		'tmp_directory': path_join(gettempdir(), 'meerkatmon')
+		'tmp_directory': None,
+		'max_parallel_checks': '8',
+		'max_checks_per_host': '2',
+		'connection_rate': '0',
+		'connection_burst': '10',
 	})
 
 	global_options_help = {
 		'mail_together': 'if False, mails will be sent by section (aggregated othewise)',
-		'mail_from': 'envelope sender for mails',
+		'mail_from': 'envelope sender for mails (default: meerkatmon@<FQDN>)',
 		'mail_threaded': 'enable threaded (per section in config file) view for email clients',
 		'mail_threaded_per_checking_host': 'enable additional threading per checking host',
-		'tmp_directory': 'a directory where MeerkatMon can store files'
+		'tmp_directory': ('a directory where MeerkatMon can store files ' +
+							'(default: meerkatmon in the system\'s temporary directory)'),
+		'max_parallel_checks': 'number of checks running at once (1: one after another)',
+		'max_checks_per_host': ('number of checks of the same host running at once ' +
+								'(may be set per section, the smallest value ' +
+								'of the sections of a host applies)'),
+		'connection_rate': ('connections opened per second by all checks ' +
+							'together (0: unlimited; if set per section, ' +
+							'limits the section additionally)'),
+		'connection_burst': ('connections opened at once before connection_rate ' +
+							'applies (may be set per section)'),
 	}
 
 	def __init__(self, config_file=None):
@@ -50,6 +74,20 @@ class MeerkatMon():
 		"""
 		if config_file:
 			self.default_configs_filename = config_file
+		self.result_handlers = []
+		from threading import RLock
+		# guards configs and results (held only briefly)
+		self.lock = RLock()
+		# section -> lock serializing checks of the section (strategies
+		# are not thread safe), see check_group()
+		self._section_locks = dict()
+
+	def add_result_handler(self, handler):
+		"""
+		Registers a callable which will be passed every CheckResult as
+		soon as the check of its section finished.
+		"""
+		self.result_handlers.append(handler)
 
 	def auto(self):
 		"""
@@ -59,61 +97,227 @@ class MeerkatMon():
 		debug("started in auto mode")
 		self.load_configs()
 		self.test_targets()
-		self.mail_results()
+		if self.mail:
+			self.mail_results()
 
-	def load_configs(self, filename = None):
+	def persistent(self, interval, control_socket=None):
 		"""
-		Coordinates loading of config.
-		Seperates special sections.
+		Run all actions like ``auto`` but repeat checking every
+		``interval`` seconds, reloading changed sections of the config
+		in between.
+		If a path for a ``control_socket`` is given, checks can be
+		requested there additionally (see lib.control).
 		"""
-		configs = self.configs
-		configs.fill_from_file(
-			filename or self.default_configs_filename
-		)
+		debug("started in persistent mode")
+		self.load_configs()
+		if control_socket:
+			from lib.control import ControlServer
+			ControlServer(control_socket, self).start()
+		while True:
+			started = time()
+			try:
+				self.test_targets()
+				if self.mail:
+					self.mail_results()
+			except Exception as error:
+				# keep running (e.g., if the mail server is down)
+				print("ERROR: run failed: %s: %s" % (
+					error.__class__.__name__, error
+				), file=stderr)
+			sleep(max(0, interval - (time() - started)))
+			with self.lock:
+				self.reload_configs()
+
+	def read_configs(self, filename):
+		"""
+		Reads config from file.
+		Returns the services' sections, the global options and the
+		default options.
+		"""
+		configs = ConfigDict()
+		configs.fill_from_file(filename)
 
-		self.global_options.update(
-			configs.pop('meerkatmon_global', dict())
-		)
+		global_options = configs.pop('meerkatmon_global', dict())
 		if 'global' in configs:
 			print(
 				"WARNING: It seems as if you are using the deprecated section" +
 				" name 'global', please rename it to 'meerkatmon_global' as it " +
-				"is incompatible with future versions."
+				"is incompatible with future versions.",
+				file=stderr
 			)
-			self.global_options.update(configs.pop('global'))
+			global_options.update(configs.pop('global'))
 
-		self.default_configs = configs.pop('meerkatmon_default', dict())
+		default_configs = configs.pop('meerkatmon_default', dict())
 		if 'default' in configs:
 			print(
 				"WARNING: It seems as if you are using the deprecated section" +
 				" name 'default', please rename it to 'meerkatmon_default' as it " +
-				"is incompatible with future versions."
+				"is incompatible with future versions.",
+				file=stderr
 			)
-			self.default_configs = configs.pop('default')
+			default_configs = configs.pop('default')
+
+		return configs, global_options, default_configs
 
+	def load_configs(self, filename = None):
+		"""
+		Coordinates loading of config.
+		Seperates special sections.
+		"""
+		filename = filename or self.default_configs_filename
+		self._configs_filename = filename
+		self._configs_mtime = getmtime(filename)
+
+		configs, global_options, default_configs = self.read_configs(filename)
+
+		self.set_global_options(global_options)
+		self.default_configs = default_configs
+
+		# unprocessed copies to detect changes when reloading
+		self._raw_configs = self._copy_raw_configs(
+			configs, global_options, default_configs
+		)
 
 		configs = self.preprocess_configs(configs)
 
 		self.configs = configs
 
+	def set_global_options(self, global_options):
+		"""
+		Sets global options (from config file) on top of the defaults.
+		"""
+		self.global_options = OptionsDict(MeerkatMon.global_options)
+		self.global_options.update(global_options)
+		if not self.global_options['tmp_directory']:
+			from tempfile import gettempdir
+			self.global_options['tmp_directory'] = path_join(
+				gettempdir(), 'meerkatmon'
+			)
+		self.executor = CheckExecutor(
+			self.global_options.get_int('max_parallel_checks'),
+			self.global_options.get_float('connection_rate'),
+			self.global_options.get_int('connection_burst'),
+		)
+
+	def get_mail_from(self):
+		"""
+		Returns the envelope sender for mails.
+		Avoids looking up the FQDN if configured explicitly.
+		"""
+		mail_from = self.global_options['mail_from']
+		if not mail_from:
+			from socket import getfqdn
+			mail_from = 'meerkatmon@%s' % getfqdn()
+		return mail_from
+
+	@staticmethod
+	def _copy_raw_configs(configs, global_options, default_configs):
+		"""
+		Returns a copy of all sections as read from file (i.e., prior
+		preprocessing, which modifies the options in place).
+		"""
+		raw_configs = {
+			section: dict(options) for section, options in configs.items()
+		}
+		raw_configs['meerkatmon_global'] = dict(global_options)
+		raw_configs['meerkatmon_default'] = dict(default_configs)
+		return raw_configs
+
+	def reload_configs(self):
+		"""
+		Reloads the config if the file has been modified.
+		Only added and changed sections are preprocessed again; all
+		other sections (and their strategies' state) are kept.
+		If the new config cannot be processed, the old one is kept.
+		Returns if the config has been reloaded.
+		"""
+		filename = self._configs_filename
+		try:
+			mtime = getmtime(filename)
+		except OSError as error:
+			print("WARNING: could not check config for changes: %s" % error,
+					file=stderr)
+			return False
+		if mtime == self._configs_mtime:
+			return False
+
+		debug("config changed, reloading")
+		old_options = (
+			self.global_options, self.default_configs, self.executor
+		)
+		try:
+			configs, raw_configs = self._reprocess_configs(filename)
+		except Exception as error:
+			self.global_options, self.default_configs, self.executor = \
+				old_options
+			print("WARNING: keeping the previous config, could not reload " +
+					"'%s': %s: %s" % (filename, error.__class__.__name__, error),
+					file=stderr)
+			return False
+
+		self.configs = configs
+		self._raw_configs = raw_configs
+		self._configs_mtime = mtime
+		return True
+
+	def _reprocess_configs(self, filename):
+		"""
+		Reads the config and preprocesses the sections which changed
+		(see reload_configs()) into a new ConfigDict.
+		Returns it and the unprocessed copy of the config.
+		"""
+		configs, global_options, default_configs = self.read_configs(filename)
+		raw_configs = self._copy_raw_configs(
+			configs, global_options, default_configs
+		)
+		old_raw_configs = self._raw_configs
+
+		special_sections = ('meerkatmon_global', 'meerkatmon_default')
+		if any(raw_configs[s] != old_raw_configs[s] for s in special_sections):
+			debug("global or default options changed, processing all sections")
+			self.set_global_options(global_options)
+			self.default_configs = default_configs
+			return self.preprocess_configs(configs), raw_configs
+
+		for section in old_raw_configs:
+			if section not in raw_configs:
+				debug("section '%s' removed" % section)
+
+		new_configs = ConfigDict()
+		for section, options in configs.items():
+			if raw_configs[section] == old_raw_configs.get(section):
+				new_configs[section] = self.configs[section]
+			else:
+				debug("section '%s' added or changed" % section)
+				new_configs[section] = self.preprocess_section(section, options)
+		return new_configs, raw_configs
+
 	def preprocess_configs(self, configs):
 		"""
 		Method prepares every service in configs for running the tests.
 		"""
-		self._strategies = MeerkatMon.get_strategies()
 		for section, options in configs.items():
-			debug("processing service '%s'" % section)
-			if section not in ['meerkatmon_default', 'meerkatmon_global']:
-				options.apply_defaults(self.default_configs)
-				options = self.parse_target(section, options)
-				options = self.assign_strategy(section, options)
-			configs[section] = options
+			configs[section] = self.preprocess_section(section, options)
 		return configs
 
+	def preprocess_section(self, section, options):
+		"""
+		Method prepares a single service for running the tests.
+		"""
+		debug("processing service '%s'" % section)
+		if section not in ['meerkatmon_default', 'meerkatmon_global']:
+			options.apply_defaults(self.default_configs)
+			options = self.parse_target(section, options)
+			options = self.assign_strategy(section, options)
+			options['request_key'] = options['strategy'].get_request_key()
+		return options
+
 	def parse_target(self, section, options):
 		"""
 		Tries to transform a "target" into a ParseResults.
 		Raises if not possible.
+		If the target expands to multiple targets (see lib.targets),
+		the first one is parsed and the expansion is remembered.
 		"""
 
 		target_str = section
@@ -124,25 +328,35 @@ class MeerkatMon():
 				"WARNING: Section '%s' has option 'target'. " % section +
 				"This option will go away in the future. " +
 				"Please use the section name as target.",
+				file=stderr
 			)
 		debug("parsing target '%s'" % target_str)
 
-		if "//" not in target_str:
-			target_str = "//" + target_str
+		if is_expandable(target_str):
+			target_count = count_targets(target_str)
+			if target_count > MAX_TARGETS:
+				raise ValueError(
+					"Section '%s' expands to %i targets (at most %i allowed)" % (
+						section, target_count, MAX_TARGETS
+					)
+				)
+			options['target_expansion'] = target_str
+			target_str = next(expand_target(target_str))
 
-		parsed_target = urlparse(target_str)
+		parsed_target = parse_target(target_str)
 		options['parsed_target'] = parsed_target
 		debug(str(parsed_target))
 
 		return options
 
 	@classmethod
-	def get_strategies(cls):
+	def get_strategies(cls, scheme=None):
 		"""
 		Acquires all strategies (classes) in the module 'strategies'.
+		If a ``scheme`` is given, only strategies which might check
+		targets with this scheme are acquired (and imported).
 		"""
-		strategies = [	t[1] for t in
-						getmembers(strategies_module, isclass) ]
+		strategies = strategies_module.get_strategies(scheme)
 		debug("found stategies: %s" % str(
 				[s.__name__ for s in strategies]
 			))
@@ -171,7 +385,8 @@ class MeerkatMon():
 		"""
 		global_options = self.global_options
 		best_strategy = (None, KNOWLEDGE_NONE)
-		for strategy in self._strategies:
+		scheme = options['parsed_target'].scheme.lower()
+		for strategy in self.get_strategies(scheme):
 			strategy_for_target = 	strategy(
 										global_options,
 										section,
@@ -184,31 +399,256 @@ class MeerkatMon():
 		debug("choosen strategy is '%s'" % best_strategy[0].__class__.__name__)
 		options['strategy'] = best_strategy[0]
 
+		if 'target_expansion' in options:
+			options['strategy'] = BatchStrategy(
+				global_options,
+				section,
+				options,
+				best_strategy[0].__class__,
+			)
+
 		return options
 
 	def test_targets(self):
 		"""
-		Method simply runs tests for every section.
+		Method runs tests for every section which is due (see option
+		``interval`` and lib.schedule).
+		"""
+		with self.lock:
+			self.run_results = dict()
+			self.results = {
+				section: result for section, result in self.results.items()
+				if section in self.configs
+			}
+		run_index = RunIndex(self.global_options['tmp_directory']).load()
+		now = time()
+		sections = [
+			section for section, options in self.configs.items()
+			if run_index.is_due(
+				section, options['strategy'].options.get_float('interval'), now
+			)
+		]
+		debug("%i of %i sections due" % (len(sections), len(self.configs)))
+		for result in self.check_sections(sections):
+			self.handle_result(result)
+			with self.lock:
+				self.run_results[result.section] = result
+			# the start of the run, as checks start later or earlier
+			# depending on the other sections
+			run_index.record(result.section, now)
+		run_index.save(self.configs)
+
+	def handle_result(self, result):
+		"""
+		Stores ``result`` as the last one of its section and passes it
+		to the result handlers.
+		"""
+		with self.lock:
+			self.results[result.section] = result
+			for handler in self.result_handlers:
+				handler(result)
+
+	def check_now(self, sections):
+		"""
+		Checks ``sections`` right away (e.g., on request via the control
+		socket) w/o mailing and returns their results.
+		Only waits for running checks of the same sections, not for
+		the rest of a periodic run.
+		"""
+		unknown_sections = [s for s in sections if s not in self.configs]
+		if unknown_sections:
+			raise ValueError(
+				"unknown sections: %s" % ', '.join(unknown_sections)
+			)
+		# a section listed twice would wait for its own lock
+		sections = list(dict.fromkeys(sections))
+		results = []
+		for result in self.check_sections(sections, force=True):
+			self.handle_result(result)
+			results.append(result)
+		return results
+
+	def get_failing_sections(self):
+		"""
+		Returns the sections whose last check failed.
+		"""
+		with self.lock:
+			results = list(self.results.items())
+		return [	section for section, result in results
+					if not result.success and section in self.configs ]
+
+	def get_section_lock(self, section):
+		"""
+		Returns the lock which serializes checks of ``section``.
+		"""
+		from threading import Lock
+		with self.lock:
+			return self._section_locks.setdefault(section, Lock())
+
+	def group_sections(self, sections, probing=()):
+		"""
+		Returns lists of sections whose strategies send identical
+		requests (sections that do not share requests are alone in their
+		lists).
+		Sections in ``probing`` (see lib.breaker) only share requests
+		with each other.
+		"""
+		groups = dict()
+		for section in sections:
+			key = self.configs[section].get('request_key')
+			if key is None:
+				key = ('section', section)
+			groups.setdefault((key, section in probing), []).append(section)
+		return list(groups.values())
+
+	def check_sections(self, sections, force=False):
 		"""
+		Generator that runs the tests for ``sections`` and yields their
+		result records.
+		Sections whose circuit is open (see lib.breaker) are only probed
+		when due, unless ``force`` is given.
+		Groups are checked concurrently (see lib.executor,
+		get_host_limits and get_rate_limit).
+		Identical requests are sent only once: the first section of each
+		group does the request, the others evaluate its response.
+		The strategies drop all other data of the check afterwards.
+		"""
+		now = time()
+		# the configs may be reloaded meanwhile (see persistent())
+		strategies = {
+			section: self.configs[section]['strategy'] for section in sections
+		}
+		breakers = {
+			section: CircuitBreaker(strategy)
+			for section, strategy in strategies.items()
+		}
+		if not force:
+			sections = [s for s in sections if breakers[s].should_check(now)]
+		probing = set(s for s in sections if breakers[s].is_open())
+
+		groups = self.group_sections(sections, probing)
+		host_limits = self.get_host_limits()
+		jobs = []
+		for group in groups:
+			host = self.get_host(group[0])
+			jobs.append(CheckJob(
+				partial(self.check_group, group, strategies, breakers),
+				host, host_limits.get(host, 1), group[0],
+				*self.get_rate_limit(group[0])
+			))
+		for results in self.executor.run(jobs):
+			for result in results:
+				yield result
+
+	def check_group(self, group, strategies, breakers, throttle=None):
+		"""
+		Checks a group of sections sharing their request (see
+		check_sections) and returns their result records.
+		``throttle`` is called before further connections are opened
+		(see lib.executor.CheckJob).
+		Holds the locks of the sections meanwhile (acquired in sorted
+		order, so that overlapping groups cannot deadlock).
+		"""
+		locks = [self.get_section_lock(section) for section in sorted(group)]
+		for lock in locks:
+			lock.acquire()
+		try:
+			return self._check_group(group, strategies, breakers, throttle)
+		finally:
+			for lock in reversed(locks):
+				lock.release()
+
+	def _check_group(self, group, strategies, breakers, throttle):
+		leader = None
+		checked = []
+		results = []
+		try:
+			for section in group:
+				debug("do check for %s" % section)
+				strategy = strategies[section]
+				strategy.set_option_overrides(
+					breakers[section].get_option_overrides()
+				)
+				started = time()
+				if leader is None:
+					strategy.set_connection_throttle(throttle)
+					strategy.do_check()
+					leader = strategy
+				else:
+					debug("sharing request of '%s'" % leader.section)
+					strategy.do_check_shared(leader)
+				checked.append(strategy)
+				result = strategy.get_result(started, time() - started)
+				results.append(breakers[section].annotate(result, started))
+		finally:
+			for strategy in checked:
+				strategy.set_option_overrides()
+				strategy.set_connection_throttle()
+				strategy.release()
+		return results
+
+	def get_host(self, section):
+		"""
+		Returns the host checked by ``section``.
+		"""
+		target = self.configs[section]['strategy'].target
+		return target.hostname or target.netloc or section
+
+	def get_host_limits(self):
+		"""
+		Returns host -> number of checks of the host running at once,
+		the smallest max_checks_per_host of all sections of the host.
+		"""
+		host_limits = dict()
 		for section, options in self.configs.items():
-			debug("do check for %s" % section)
-			options['strategy'].do_check()
+			limit = options.get_int(
+				'max_checks_per_host',
+				self.global_options['max_checks_per_host']
+			)
+			host = self.get_host(section)
+			host_limits[host] = min(limit, host_limits.get(host, limit))
+		return host_limits
+
+	def get_rate_limit(self, section):
+		"""
+		Returns the connection rate and burst ``section`` is limited to
+		in addition to the global rate (rate 0 if it sets none itself).
+		"""
+		options = self.configs[section]
+		if 'connection_rate' not in options:
+			return (0, 1)
+		return (
+			options.get_float('connection_rate'),
+			options.get_int(
+				'connection_burst', self.global_options['connection_burst']
+			),
+		)
 
 	def mail_results(self):
 		"""
 		Method is responsible for informing the cerresponding admin
 		about errors and success (if desired).
 		"""
+		with self.lock:
+			run_results = list(self.run_results.items())
 		results = dict()
-		for section, options in self.configs.items():
-			strategy = options['strategy']
+		for section, result in run_results:
+			options = self.configs.get(section)
+			if options is None:
+				# removed from the config meanwhile
+				continue
+
+			if result.circuit == 'open':
+				# failing probe, already mailed when the circuit opened
+				continue
 
-			if not options.get_bool('mail_success') and strategy.get_last_check_success():
+			if (	not options.get_bool('mail_success') and result.success
+					and result.circuit != 'reclosed' ):
 				continue
 
 			results[section] = {
-				'message': strategy.get_mail_message(),
-				'subject': strategy.get_mail_subject()
+				'message': result.message,
+				'subject': result.subject
 			}
 
 		if self.global_options.get_bool('mail_together'):
@@ -225,6 +665,7 @@ class MeerkatMon():
 			references += '."%s"' % section
 		references += "@meerkatmon"
 		if global_options.get_bool('mail_threaded_per_checking_host'):
+			from socket import getfqdn
 			references += ".%s" % getfqdn()
 		headers["References"] = "<%s>" % references
 		return headers
@@ -233,7 +674,7 @@ class MeerkatMon():
 		"""
 		Method mails test results all together to global admin.
 		"""
-		mail_from = self.global_options['mail_from']
+		mail_from = self.get_mail_from()
 		mail_admin = self.default_configs['admin']
 		mail_subject = 'Output from checking ' + ', '.join(list(results.keys()))
 		mail_messages_delim = "\n\n%s\n\n" % ("="*80)
@@ -263,7 +704,7 @@ class MeerkatMon():
 		# list of tuples: (<header dict>, <message str>)
 		headers_and_messages = list()
 
-		mail_from = self.global_options['mail_from']
+		mail_from = self.get_mail_from()
 		for section, result in results.items():
 			mail_to = self.configs[section]['admin']
 			mail_subject = result['subject']
@@ -286,6 +727,11 @@ class MeerkatMon():
 		if not headers_and_messages:
 			return
 
+		from smtplib import SMTP
+		from email.mime.text import MIMEText
+		# see http://bugs.python.org/issue18557
+		from email.utils import getaddresses
+
 		s = SMTP('localhost')
 		for headers, message in headers_and_messages:
 			msg = MIMEText(message)
@@ -300,5 +746,5 @@ class MeerkatMon():
 				)
 			except ConnectionRefusedError:
 				print("ERROR: could not send emails. "
-				      "Connection to localhost refused.")
+				      "Connection to localhost refused.", file=stderr)
 		s.quit()
@@ -0,0 +1,122 @@
+"""
+Module provides a circuit breaker for sections whose target is down
+persistently.
+
+After ``breaker_threshold`` consecutive failures the circuit of a section
+opens: the section is then only probed every ``breaker_probe_interval``
+seconds with a timeout of ``breaker_probe_timeout`` seconds (and is not
+mailed about again) until a probe succeeds, which closes the circuit.
+The state is kept per section in the tmp_directory (see
+BaseStrategy.save_state).
+"""
+
+from lib.util import debug
+
+STATE_EXTENSION = 'breaker'
+
+CIRCUIT_CLOSED = 'closed'
+# circuit opened by this check
+CIRCUIT_OPENED = 'opened'
+# circuit has been open before and stays open
+CIRCUIT_OPEN = 'open'
+# circuit has been open before and is closed by this check
+CIRCUIT_RECLOSED = 'reclosed'
+
+class CircuitBreaker(object):
+	"""
+	Circuit breaker of the section checked by ``strategy``.
+	"""
+
+	def __init__(self, strategy):
+		self.strategy = strategy
+		options = strategy.options
+		self.threshold = options.get_int('breaker_threshold', 0)
+		self.probe_interval = options.get_float('breaker_probe_interval', 3600)
+		self.probe_timeout = options.get('breaker_probe_timeout', '2')
+		self._state = None
+
+	@property
+	def enabled(self):
+		return self.threshold > 0
+
+	@property
+	def state(self):
+		if self._state is None:
+			self._state = self.strategy.load_state(STATE_EXTENSION)
+		return self._state
+
+	def is_open(self):
+		return self.enabled and self.state.get('open', False)
+
+	def should_check(self, now):
+		"""
+		Returns whether the section is to be checked at ``now`` (i.e.,
+		the circuit is closed or a probe is due).
+		"""
+		if not self.is_open():
+			return True
+		due = self.state.get('last_probe', 0) + self.probe_interval
+		if now < due:
+			debug("circuit of '%s' open, next probe in %i s" % (
+				self.strategy.section, due - now
+			))
+			return False
+		return True
+
+	def get_option_overrides(self):
+		"""
+		Returns options to check with (see
+		BaseStrategy.set_option_overrides).
+		"""
+		if self.is_open():
+			return {'timeout': self.probe_timeout}
+		return None
+
+	def annotate(self, result, now):
+		"""
+		Records the outcome of a check and returns ``result`` with the
+		state of the circuit added.
+		"""
+		if not self.enabled:
+			return result
+
+		state = self.state
+		was_open = state.get('open', False)
+		failures = 0 if result.success else state.get('failures', 0) + 1
+
+		if result.success:
+			circuit = CIRCUIT_RECLOSED if was_open else CIRCUIT_CLOSED
+		elif was_open:
+			circuit = CIRCUIT_OPEN
+		elif failures >= self.threshold:
+			circuit = CIRCUIT_OPENED
+		else:
+			circuit = CIRCUIT_CLOSED
+
+		is_open = circuit in (CIRCUIT_OPENED, CIRCUIT_OPEN)
+		self._state = {
+			'failures': failures,
+			'open': is_open,
+			'last_probe': now if is_open else None,
+		}
+		self.strategy.save_state(STATE_EXTENSION, self._state)
+
+		if circuit == CIRCUIT_CLOSED:
+			return result.replace(circuit=circuit)
+
+		if circuit == CIRCUIT_RECLOSED:
+			note = "circuit closed: probe succeeded, full checks resume"
+		else:
+			note = (
+				"circuit open after %i consecutive failures: probing every " +
+				"%i s with a timeout of %s s until a probe succeeds"
+			) % (failures, self.probe_interval, self.probe_timeout)
+		debug("'%s': %s" % (result.section, note))
+		return result.replace(
+			circuit=circuit,
+			subject="[circuit %s] %s" % (
+				'closed' if circuit == CIRCUIT_RECLOSED else 'open',
+				result.subject,
+			),
+			message="%s\n\n%s" % (result.message, note),
+		)
@@ -0,0 +1,119 @@
+"""
+Module provides a control socket (Unix domain socket) for a MeerkatMon
+running in persistent mode and a function to talk to it.
+
+Protocol: per connection, the client sends one JSON object (one line)
+and the server answers with one JSON object (one line).
+Requests look like ``{"command": "check", "sections": ["example.com"]}``.
+
+Commands:
+	check			check the given sections now
+	check-failing	check all sections whose last check failed now
+	dump			return the last results and all sections
+"""
+
+import stat
+from json import loads, dumps
+from os import chmod, lstat, unlink
+from socket import socket, AF_UNIX, SOCK_STREAM
+from socketserver import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+from threading import Thread
+
+from lib.util import debug
+
+COMMANDS = ('check', 'check-failing', 'dump')
+
+class ControlRequestHandler(StreamRequestHandler):
+	"""
+	Reads a request, lets the server handle it and writes the response.
+	"""
+
+	def handle(self):
+		try:
+			request = loads(self.rfile.readline().decode('utf8'))
+			response = self.server.handle_request_dict(request)
+		except Exception as error:
+			response = {'error': "%s: %s" % (error.__class__.__name__, error)}
+		self.wfile.write(dumps(response).encode('utf8') + b'\n')
+
+class ControlServer(ThreadingMixIn, UnixStreamServer):
+	"""
+	Serves the control socket for ``monitor`` (a MeerkatMon) at ``path``.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, path, monitor):
+		self.remove_stale_socket(path)
+		UnixStreamServer.__init__(self, path, ControlRequestHandler)
+		chmod(path, 0 | stat.S_IRUSR | stat.S_IWUSR)
+		self.monitor = monitor
+
+	@staticmethod
+	def remove_stale_socket(path):
+		"""
+		Removes a socket left at ``path`` (e.g., by a previous run),
+		refuses to replace anything else.
+		"""
+		try:
+			mode = lstat(path).st_mode
+		except FileNotFoundError:
+			return
+		if not stat.S_ISSOCK(mode):
+			raise FileExistsError(
+				"'%s' exists and is not a socket, not replacing it" % path
+			)
+		unlink(path)
+
+	def start(self):
+		"""
+		Starts serving in a background thread.
+		"""
+		debug("serving control socket at '%s'" % self.server_address)
+		Thread(target=self.serve_forever, daemon=True).start()
+
+	def handle_request_dict(self, request):
+		"""
+		Executes a request and returns the response (both dicts).
+		"""
+		monitor = self.monitor
+		command = request.get('command')
+		debug("control command '%s'" % command)
+
+		if command == 'check':
+			results = monitor.check_now(request.get('sections') or [])
+		elif command == 'check-failing':
+			results = monitor.check_now(monitor.get_failing_sections())
+		elif command == 'dump':
+			with monitor.lock:
+				results = [	result for section, result in monitor.results.items()
+							if section in monitor.configs ]
+		else:
+			raise ValueError(
+				"unknown command '%s' (known: %s)" % (command, ', '.join(COMMANDS))
+			)
+
+		response = {'results': [result.as_dict() for result in results]}
+		if command == 'dump':
+			response['sections'] = {
+				section: options['strategy'].__class__.__name__
+				for section, options in monitor.configs.items()
+			}
+		return response
+
+def send_request(path, command, sections=None):
+	"""
+	Sends a request to the control socket at ``path`` and returns the
+	response (dict).
+	"""
+	request = {'command': command}
+	if sections:
+		request['sections'] = list(sections)
+	client = socket(AF_UNIX, SOCK_STREAM)
+	try:
+		client.connect(path)
+		client.sendall(dumps(request).encode('utf8') + b'\n')
+		with client.makefile('rb') as response_file:
+			return loads(response_file.readline().decode('utf8'))
+	finally:
+		client.close()
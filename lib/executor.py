@@ -0,0 +1,177 @@
+"""
+Module provides the executor that runs checks concurrently, while
+bounding the load on every single host and the rate of new connections.
+
+Limits (see MeerkatMon.global_options):
+	max_parallel_checks		checks running at once (overall)
+	max_checks_per_host		checks of the same host running at once (if
+							set per section, the smallest value of all
+							sections of a host applies to the host)
+	connection_rate			new connections (checks) per second of all
+							checks together (token bucket, 0: unlimited)
+	connection_burst		connections that may be opened at once before
+							connection_rate applies
+
+If a section sets connection_rate (and connection_burst) itself, its
+connections are limited by a bucket of its own additionally, i.e., they
+still count against the global rate.
+"""
+
+from time import monotonic, sleep
+
+from lib.util import debug
+
+class TokenBucket(object):
+	"""
+	Thread safe token bucket, refilled with ``rate`` tokens per second
+	up to ``burst`` tokens.
+	"""
+
+	def __init__(self, rate, burst):
+		from threading import Lock
+		self.rate = rate
+		self.burst = max(burst, 1)
+		self.tokens = self.burst
+		self.updated = monotonic()
+		self.lock = Lock()
+
+	def acquire(self):
+		"""
+		Takes a token, waits until there is one if necessary.
+		Tokens are reserved in advance (i.e., the bucket may become
+		negative), so that waiting threads are served in order.
+		"""
+		with self.lock:
+			now = monotonic()
+			self.tokens = min(
+				self.burst, self.tokens + (now - self.updated) * self.rate
+			)
+			self.updated = now
+			self.tokens -= 1
+			wait = -self.tokens / self.rate if self.tokens < 0 else 0
+		if wait:
+			debug("rate limited, waiting %.2f s" % wait)
+			sleep(wait)
+
+class CheckJob(object):
+	"""
+	A check to run: ``function`` checks ``host`` (limited to
+	``host_limit`` concurrent checks), opening connections at the global
+	rate and, if ``rate`` is given, at ``rate`` per second (``burst`` at
+	once) for ``section``.
+	``function`` is called once the host limit permits and tokens have
+	been taken. It is passed a callable which takes further tokens (or
+	``None`` if the rate is unlimited), to be called before opening any
+	further connection.
+	"""
+
+	__slots__ = ('function', 'host', 'host_limit', 'section', 'rate', 'burst')
+
+	def __init__(self, function, host, host_limit=1, section=None, rate=0,
+					burst=1):
+		self.function = function
+		self.host = host
+		self.host_limit = host_limit
+		self.section = section
+		self.rate = rate
+		self.burst = burst
+
+class CheckExecutor(object):
+	"""
+	Runs CheckJobs in up to ``max_parallel`` threads, opening at most
+	``rate`` connections per second (``burst`` at once) overall.
+	Host semaphores and section buckets are kept between runs, keyed by
+	host and section respectively (and replaced if their limits change).
+	"""
+
+	def __init__(self, max_parallel=1, rate=0, burst=1):
+		from threading import Lock
+		self.max_parallel = max(max_parallel, 1)
+		self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+		self._host_semaphores = dict()
+		self._buckets = dict()
+		self._lock = Lock()
+
+	def get_host_semaphore(self, host, limit):
+		from threading import BoundedSemaphore
+		limit = max(limit, 1)
+		with self._lock:
+			if self._host_semaphores.get(host, (None, ))[0] != limit:
+				self._host_semaphores[host] = (limit, BoundedSemaphore(limit))
+			return self._host_semaphores[host][1]
+
+	def get_section_bucket(self, section, rate, burst):
+		"""
+		Returns the token bucket of ``section``, ``None`` if it has no
+		rate of its own.
+		"""
+		if rate <= 0:
+			return None
+		with self._lock:
+			if self._buckets.get(section, (None, ))[0] != (rate, burst):
+				self._buckets[section] = ((rate, burst), TokenBucket(rate, burst))
+			return self._buckets[section][1]
+
+	def _run_job(self, job):
+		# the section's bucket first, so that no global tokens are
+		# reserved while waiting for it
+		buckets = [
+			bucket for bucket in (
+				self.get_section_bucket(job.section, job.rate, job.burst),
+				self.bucket,
+			) if bucket is not None
+		]
+		with self.get_host_semaphore(job.host, job.host_limit):
+			if not buckets:
+				return job.function(None)
+
+			def throttle():
+				for bucket in buckets:
+					bucket.acquire()
+
+			throttle()
+			return job.function(throttle)
+
+	@staticmethod
+	def _interleave_hosts(jobs):
+		"""
+		Reorders jobs to alternate between hosts, so that threads
+		waiting for a busy host do not hold up the other hosts.
+		"""
+		by_host = dict()
+		for job in jobs:
+			by_host.setdefault(job.host, []).append(job)
+		queues = list(by_host.values())
+		interleaved = []
+		while queues:
+			for queue in list(queues):
+				interleaved.append(queue.pop(0))
+				if not queue:
+					queues.remove(queue)
+		return interleaved
+
+	def run(self, jobs):
+		"""
+		Generator that runs ``jobs`` and yields their return values as
+		soon as they finish.
+		Runs the jobs one after another in the calling thread if only
+		one job may run at once.
+		"""
+		jobs = self._interleave_hosts(jobs)
+		if self.max_parallel == 1 or len(jobs) <= 1:
+			for job in jobs:
+				yield self._run_job(job)
+			return
+
+		from concurrent.futures import ThreadPoolExecutor, as_completed
+		debug("running %i checks in up to %i threads" % (
+			len(jobs), self.max_parallel
+		))
+		with ThreadPoolExecutor(self.max_parallel) as pool:
+			futures = [pool.submit(self._run_job, job) for job in jobs]
+			try:
+				for future in as_completed(futures):
+					yield future.result()
+			finally:
+				for future in futures:
+					future.cancel()
@@ -0,0 +1,292 @@
+"""
+Module provides network helpers shared by the strategies.
+"""
+
+from errno import EINPROGRESS, EWOULDBLOCK, EAGAIN
+from os import strerror
+from selectors import DefaultSelector, EVENT_WRITE
+from socket import (	getaddrinfo, getdefaulttimeout, socket, timeout as
+						SocketTimeout, error as SocketError, AF_INET, AF_INET6,
+						SOCK_STREAM, SOL_SOCKET, SO_ERROR )
+from time import monotonic
+
+from lib.util import debug
+
+# delay between starting connection attempts, as recommended by RFC 8305
+CONNECTION_ATTEMPT_DELAY = 0.25
+# seconds attempts which are still pending once another attempt won may
+# take to complete (so that a slower family is not reported as broken)
+LOSER_GRACE_PERIOD = 1.0
+
+FAMILY_NAMES = {
+	AF_INET: 'IPv4',
+	AF_INET6: 'IPv6',
+}
+
+class ConnectionReport(object):
+	"""
+	Describes how happy_eyeballs() established a connection.
+	"""
+
+	def __init__(self):
+		# names of all families the host resolved to
+		self.families = set()
+		# family name and address of the connection that won
+		self.family = None
+		self.address = None
+		# family name -> list of problems (connect errors and timeouts)
+		self.problems = dict()
+		# names of families which could be connected to
+		self.working = set()
+		# family name -> list of addresses still connecting after
+		# LOSER_GRACE_PERIOD
+		self.slow = dict()
+
+	def add_problem(self, family, problem):
+		self.problems.setdefault(FAMILY_NAMES.get(family, str(family)),
+									[]).append(problem)
+
+	def add_working(self, family):
+		self.working.add(FAMILY_NAMES.get(family, str(family)))
+
+	def add_slow(self, family, address):
+		self.slow.setdefault(FAMILY_NAMES.get(family, str(family)),
+								[]).append(address)
+
+	def get_broken_families(self):
+		"""
+		Returns names of families which the host has addresses of but
+		which could not be connected to (hidden by another family).
+		Families which are merely slower than the winner do not count.
+		"""
+		return sorted(
+			family for family in self.problems
+			if family not in self.working and family in self.families
+		)
+
+	def describe(self):
+		"""
+		Returns a short human readable description.
+		"""
+		if self.family is None:
+			return "could not connect"
+		description = "connected via %s (%s)" % (self.family, self.address)
+		for family in self.get_broken_families():
+			description += "\n%s broken: %s" % (
+				family, ', '.join(self.problems[family])
+			)
+		for family in sorted(self.slow):
+			if family not in self.working:
+				description += "\n%s slow: %s still connecting" % (
+					family, ', '.join(self.slow[family])
+				)
+		return description
+
+def _interleave_families(address_infos):
+	"""
+	Reorders address infos to alternate between families, starting with
+	the family of the first (i.e., preferred) address (RFC 8305, 4).
+	"""
+	by_family = dict()
+	for address_info in address_infos:
+		by_family.setdefault(address_info[0], []).append(address_info)
+	queues = list(by_family.values())
+	interleaved = []
+	while queues:
+		for queue in list(queues):
+			interleaved.append(queue.pop(0))
+			if not queue:
+				queues.remove(queue)
+	return interleaved
+
+def happy_eyeballs(address, timeout=None, source_address=None, report=None):
+	"""
+	Like ``socket.create_connection``, but races connection attempts to
+	all addresses of a host, alternating between address families, and
+	starting a new attempt every CONNECTION_ATTEMPT_DELAY seconds or
+	once the previous attempt failed (RFC 8305).
+	Details about the race are stored in ``report`` (ConnectionReport),
+	if provided.
+	"""
+	if report is None:
+		report = ConnectionReport()
+	if not isinstance(timeout, (int, float)):
+		timeout = getdefaulttimeout()
+
+	host, port = address
+	address_infos = _interleave_families(getaddrinfo(host, port, 0, SOCK_STREAM))
+	report.families = set(
+		FAMILY_NAMES.get(info[0], str(info[0])) for info in address_infos
+	)
+
+	deadline = monotonic() + timeout if timeout is not None else None
+	selector = DefaultSelector()
+	pending = dict()
+	winner = None
+	last_error = None
+	next_attempt = 0
+
+	try:
+		while winner is None:
+			now = monotonic()
+
+			if deadline is not None and now >= deadline:
+				for sock, address_info in pending.items():
+					report.add_problem(address_info[0], "%s timed out" %
+										address_info[4][0])
+				raise SocketTimeout("timed out")
+
+			if address_infos and (not pending or now >= next_attempt):
+				family, type_, proto, _, sockaddr = address_infos.pop(0)
+				sock = socket(family, type_, proto)
+				sock.setblocking(False)
+				try:
+					if source_address:
+						sock.bind(source_address)
+					error = sock.connect_ex(sockaddr)
+				except SocketError as exception:
+					error = exception.errno
+				if error == 0:
+					winner = (sock, family, sockaddr)
+				elif error in (EINPROGRESS, EWOULDBLOCK, EAGAIN):
+					selector.register(sock, EVENT_WRITE)
+					pending[sock] = (family, type_, proto, _, sockaddr)
+					next_attempt = now + CONNECTION_ATTEMPT_DELAY
+				else:
+					sock.close()
+					last_error = SocketError(error, "%s (%s)" % (
+						strerror(error), sockaddr[0]
+					))
+					report.add_problem(family, str(last_error))
+				continue
+
+			if not pending:
+				raise last_error or SocketError("no addresses for %s" % host)
+
+			waits = []
+			if address_infos:
+				waits.append(next_attempt - now)
+			if deadline is not None:
+				waits.append(deadline - now)
+			wait = max(0, min(waits)) if waits else None
+
+			for key, _ in selector.select(wait):
+				sock = key.fileobj
+				family, _, _, _, sockaddr = pending.pop(sock)
+				selector.unregister(sock)
+				error = sock.getsockopt(SOL_SOCKET, SO_ERROR)
+				if error == 0 and winner is None:
+					winner = (sock, family, sockaddr)
+				elif error == 0:
+					sock.close()
+					report.add_working(family)
+				else:
+					sock.close()
+					last_error = SocketError(error, "%s (%s)" % (
+						strerror(error), sockaddr[0]
+					))
+					report.add_problem(family, str(last_error))
+					# start next attempt right away
+					next_attempt = now
+
+		# let pending attempts complete, to tell slow from broken families
+		report.add_working(winner[1])
+		grace_end = monotonic() + LOSER_GRACE_PERIOD
+		if deadline is not None:
+			grace_end = min(grace_end, deadline)
+		while pending:
+			wait = grace_end - monotonic()
+			if wait <= 0:
+				break
+			for key, _ in selector.select(wait):
+				sock = key.fileobj
+				family, _, _, _, sockaddr = pending.pop(sock)
+				selector.unregister(sock)
+				error = sock.getsockopt(SOL_SOCKET, SO_ERROR)
+				sock.close()
+				if error == 0:
+					report.add_working(family)
+				else:
+					report.add_problem(family, str(SocketError(error, "%s (%s)" % (
+						strerror(error), sockaddr[0]
+					))))
+
+	finally:
+		for sock, address_info in pending.items():
+			if winner is not None:
+				report.add_slow(address_info[0], address_info[4][0])
+			sock.close()
+		selector.close()
+
+	sock, family, sockaddr = winner
+	sock.setblocking(True)
+	sock.settimeout(timeout)
+	report.family = FAMILY_NAMES.get(family, str(family))
+	report.address = sockaddr[0]
+	debug("connection race: %s" % report.describe())
+	return sock
+
+# TLS contexts, sessions and certificates are kept per process and
+# shared between checks, so that repeated handshakes can be abbreviated
+# (sessions can only be resumed with the context that created them)
+_tls_contexts = dict()
+_tls_sessions = dict()
+_certificates = dict()
+
+def get_tls_context(verify=True):
+	"""
+	Returns a shared TLS context which verifies certificates or not.
+	"""
+	if verify not in _tls_contexts:
+		from ssl import create_default_context, _create_unverified_context
+		if verify:
+			_tls_contexts[verify] = create_default_context()
+		else:
+			_tls_contexts[verify] = _create_unverified_context()
+	return _tls_contexts[verify]
+
+def get_tls_session(context, key):
+	"""
+	Returns the last TLS session of ``context`` for ``key`` (e.g., host
+	and port), ``None`` if there is none.
+	"""
+	return _tls_sessions.get((id(context), key))
+
+def remember_tls_session(context, key, tls_socket):
+	"""
+	Remembers the session of ``tls_socket`` (which uses ``context``) for
+	``key`` (must be called prior closing the socket).
+	"""
+	try:
+		session = tls_socket.session
+	except (AttributeError, ValueError):
+		return
+	if session is not None:
+		_tls_sessions[(id(context), key)] = session
+
+def get_certificate_info(key, tls_socket):
+	"""
+	Returns a dict describing the certificate of the peer of
+	``tls_socket`` (``None`` if not available, e.g., if not verified).
+	Falls back to the certificate last seen for ``key``.
+	"""
+	certificate = tls_socket.getpeercert()
+	if certificate:
+		from ssl import cert_time_to_seconds
+		_certificates[key] = {
+			'subject': _format_name(certificate.get('subject', ())),
+			'issuer': _format_name(certificate.get('issuer', ())),
+			'not_after': cert_time_to_seconds(certificate['notAfter']),
+		}
+	info = _certificates.get(key)
+	if info is not None:
+		info = dict(info, session_reused=tls_socket.session_reused)
+	return info
+
+def _format_name(name):
+	"""
+	Formats a subject or issuer as returned by SSLSocket.getpeercert().
+	"""
+	return ', '.join(
+		"%s=%s" % attribute for rdn in name for attribute in rdn
+	)
@@ -0,0 +1,79 @@
+"""
+Module provides records for the outcome of checks and writers for them.
+
+Records are decoupled from the strategies that produced them, so that
+strategies can drop responses etc. right after checking.
+"""
+
+class CheckResult(object):
+	"""
+	Compact, immutable record of the outcome of a check of a section.
+	"""
+
+	__slots__ = (
+		'section',
+		'strategy',
+		'success',
+		'subject',
+		'message',
+		'started',
+		'duration',
+		'fingerprint',
+		'circuit',
+	)
+
+	def __init__(self, section, strategy, success, subject, message,
+					started=None, duration=None, fingerprint=None, circuit=None):
+		set_attribute = super(CheckResult, self).__setattr__
+		set_attribute('section', section)
+		set_attribute('strategy', strategy)
+		set_attribute('success', success)
+		set_attribute('subject', subject)
+		set_attribute('message', message)
+		set_attribute('started', started)
+		set_attribute('duration', duration)
+		set_attribute('fingerprint', fingerprint)
+		# state of the circuit breaker: None, 'closed', 'opened' or 'open'
+		set_attribute('circuit', circuit)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("%s is immutable" % self.__class__.__name__)
+
+	def __delattr__(self, name):
+		raise AttributeError("%s is immutable" % self.__class__.__name__)
+
+	def __repr__(self):
+		return "%s(%s)" % (
+			self.__class__.__name__,
+			', '.join(
+				"%s=%r" % (name, getattr(self, name)) for name in self.__slots__
+			)
+		)
+
+	def as_dict(self):
+		"""
+		Returns all fields as dictionary.
+		"""
+		return {name: getattr(self, name) for name in self.__slots__}
+
+	def replace(self, **changes):
+		"""
+		Returns a copy with the given fields changed.
+		"""
+		fields = self.as_dict()
+		fields.update(changes)
+		return self.__class__(**fields)
+
+class NdjsonWriter(object):
+	"""
+	Writes results as newline delimited JSON (one object per line) to a
+	file object, as soon as they are passed.
+	"""
+
+	def __init__(self, file_object):
+		self.file_object = file_object
+
+	def __call__(self, result):
+		from json import dumps
+		self.file_object.write(dumps(result.as_dict(), sort_keys=True) + "\n")
+		self.file_object.flush()
@@ -0,0 +1,111 @@
+"""
+Module provides an index of when sections have been checked last, so
+that frequent (e.g., per minute) runs only check the sections which are
+due according to their ``interval`` option.
+
+The index is kept in a single compact JSON file in the tmp_directory
+(section -> start of its last check, in seconds since the epoch).
+Overlapping runs merge their records when saving the index.
+"""
+
+import stat
+from getpass import getuser
+from os import chmod, getpid, makedirs, replace, sep, open as os_open
+from os.path import join as path_join, dirname, isdir
+
+from lib.util import debug
+
+# seconds sections are due early, so that runs scheduled every
+# ``interval`` seconds (e.g., by cron) do not skip a section because
+# their start is delayed a bit
+DUE_TOLERANCE = 5
+
+class RunIndex(object):
+	"""
+	Last-run index stored in ``directory``.
+	"""
+
+	def __init__(self, directory):
+		self.filename = path_join(
+			directory,
+			"__".join((getuser(), "last_runs.json")).replace(sep, "_"),
+		)
+		self.last_runs = None
+
+	def load(self):
+		"""
+		Reads the index from file (empty if there is none).
+		"""
+		self.last_runs = self._read()
+		return self
+
+	def _read(self):
+		from json import load as json_load
+		try:
+			with open(self.filename, 'r', encoding='utf8') as file_object:
+				return json_load(file_object)
+		except (IOError, ValueError):
+			return dict()
+
+	def save(self, sections=None):
+		"""
+		Writes the index to file, dropping sections not in ``sections``
+		(e.g., removed from the config), if given.
+		As runs might overlap, the index is read again and merged (the
+		latest run of each section wins) while holding a lock, and the
+		file is replaced atomically.
+		"""
+		from fcntl import flock, LOCK_EX, LOCK_UN
+		from json import dump as json_dump
+		directory = dirname(self.filename)
+		if not isdir(directory):
+			makedirs(
+				directory,
+				0 | stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
+			)
+		with open(
+			self.filename + ".lock", 'a',
+			opener=lambda path, flags: os_open(
+				path, flags, 0 | stat.S_IRUSR | stat.S_IWUSR
+			),
+		) as lock_file:
+			flock(lock_file, LOCK_EX)
+			try:
+				last_runs = self._read()
+				for section, last_run in self.last_runs.items():
+					last_runs[section] = max(
+						last_run, last_runs.get(section, last_run)
+					)
+				if sections is not None:
+					last_runs = {
+						section: last_run for section, last_run in last_runs.items()
+						if section in sections
+					}
+				self.last_runs = last_runs
+				tmp_filename = "%s.%i.tmp" % (self.filename, getpid())
+				with open(tmp_filename, 'w', encoding='utf8') as file_object:
+					json_dump(last_runs, file_object, separators=(',', ':'))
+				chmod(tmp_filename, 0 | stat.S_IRUSR | stat.S_IWUSR)
+				replace(tmp_filename, self.filename)
+			finally:
+				flock(lock_file, LOCK_UN)
+
+	def is_due(self, section, interval, now):
+		"""
+		Returns whether ``section`` is to be checked at ``now`` if it
+		is to be checked every ``interval`` seconds.
+		"""
+		last_run = self.last_runs.get(section)
+		if last_run is None or interval <= 0:
+			return True
+		due = last_run + interval - DUE_TOLERANCE
+		if now < due:
+			debug("'%s' not due for %i s" % (section, due - now))
+			return False
+		return True
+
+	def record(self, section, started):
+		"""
+		Records that ``section`` has been checked at ``started``.
+		"""
+		self.last_runs[section] = round(started, 1)
@@ -3,12 +3,16 @@ Module provides base class for all strategies.
 """
 
 import stat
+from itertools import islice
+from time import time
 from urllib.parse import ParseResult
 from os import access, environ, pathsep, X_OK, sep, chmod, makedirs
 from os.path import isfile, join as path_join, dirname, isdir
 
 from lib.config import OptionsDict
 from lib.util import debug
+from lib.targets import parse_target, expand_target
+from lib.results import CheckResult
 
 KNOWLEDGE_NONE = 0
 KNOWLEDGE_EXISTS = 10
@@ -30,16 +34,40 @@ class BaseStrategy:
 		'timeout': '10',
 		'admin': 'root@localhost',
 		'mail_success': False,
+		'interval': '0',
+		'breaker_threshold': '0',
+		'breaker_probe_interval': '3600',
+		'breaker_probe_timeout': '2',
 	})
 
 	_base_options_help = {
 		'timeout': 'seconds until network operations time out',
 		'admin': 'e mail adress of administrator for a section',
 		'mail_success': 'if True, mails will be sent on success too',
+		'interval': ('check at most every this many seconds, even if run more ' +
+						'often (0: check on every run)'),
+		'breaker_threshold': ('after this many consecutive failures, only probe ' +
+								'the target from time to time (0 disables)'),
+		'breaker_probe_interval': 'seconds between probes of failed targets',
+		'breaker_probe_timeout': 'timeout for probes of failed targets',
 	}
 
 	strategy_help = ""
 
+	# attributes holding (potentially large) check data, dropped by release()
+	_released_attributes = ('message', )
+
+	# attributes holding the response of a request, copied from the leader
+	# by do_check_shared() before _evaluate() (None: requests not shared)
+	_shared_attributes = None
+
+	# options temporarily taking precedence, see set_option_overrides()
+	_option_overrides = OptionsDict()
+
+	# called before opening further connections, see
+	# set_connection_throttle()
+	_connection_throttle = None
+
 	def __init__(self, global_options, section, options):
 		target = options['parsed_target']
 		if not isinstance(target, ParseResult):
@@ -71,6 +99,7 @@ class BaseStrategy:
 		"""
 		options = OptionsDict(self._base_options)
 		options.update(self._options)
+		options.update(self._option_overrides)
 		return options
 
 	@options.setter
@@ -80,6 +109,21 @@ class BaseStrategy:
 		"""
 		self._options = options
 
+	def set_option_overrides(self, overrides=None):
+		"""
+		Sets options which take precedence over the configured ones
+		(e.g., a shorter timeout) until reset (``None``).
+		"""
+		self._option_overrides = OptionsDict(overrides or dict())
+
+	def set_connection_throttle(self, throttle=None):
+		"""
+		Sets a callable which strategies opening more than one
+		connection per check (e.g., batches) call before each further
+		connection (see lib.executor), until reset (``None``).
+		"""
+		self._connection_throttle = throttle
+
 	@classmethod
 	def get_options_help(cls):
 		"""
@@ -145,6 +189,43 @@ class BaseStrategy:
 		"""
 		self.__class__._raise_subclass_error('do_check')
 
+	def get_request_key(self):
+		"""
+		Returns a hashable key that identifies the request this strategy
+		sends, or ``None`` if the request must not be shared.
+		Sections whose strategies return equal keys are checked with a
+		single request (see do_check_shared).
+		"""
+		return None
+
+	def do_check_shared(self, leader):
+		"""
+		Runs the checks on the response which ``leader`` (a strategy
+		with an equal request key) received during its do_check().
+		Strategies which support sharing requests declare the attributes
+		holding the response in _shared_attributes and evaluate them in
+		_evaluate().
+		"""
+		if self._shared_attributes is None:
+			self.do_check()
+			return
+		for name in self._shared_attributes:
+			setattr(self, name, getattr(leader, name))
+		self._evaluate()
+
+	@classmethod
+	def do_check_batch(cls, strategies, throttle=None):
+		"""
+		Runs the checks of many instances of this strategy, calling
+		``throttle`` (if given) before each.
+		Strategies which can check multiple targets at once should
+		override this.
+		"""
+		for strategy in strategies:
+			if throttle:
+				throttle()
+			strategy.do_check()
+
 	def get_mail_message(self):
 		"""
 		Returns the subject and body containing *all* relevant
@@ -176,20 +257,50 @@ class BaseStrategy:
 		"""
 		self.__class__._raise_subclass_error('get_last_check_success()')
 
-	def get_sample_filename(self):
+	def get_result(self, started=None, duration=None):
+		"""
+		Returns a compact record of the last check.
 		"""
-		Returns the file name where the state is saved in.
+		return CheckResult(
+			self.section,
+			self.__class__.__name__,
+			self.get_last_check_success(),
+			self.get_mail_subject(),
+			self.get_mail_message(),
+			started,
+			duration,
+			getattr(self, 'fingerprint', None),
+		)
+
+	def release(self):
+		"""
+		Drops data of the last check (use get_result() before).
+		"""
+		for name in self._released_attributes:
+			if name in self.__dict__:
+				setattr(self, name, None)
+
+	def get_state_filename(self, extension):
+		"""
+		Returns the file name where state of kind ``extension`` for
+		this section is saved in.
 		"""
 		file_name = "__".join((
 			environ["LOGNAME"],
 			self.section,
-		)) + ".sample"
+		)) + "." + extension
 		file_name = file_name.replace(sep, "_")
 		return path_join(
 			self.global_options['tmp_directory'],
 			file_name,
 		)
 
+	def get_sample_filename(self):
+		"""
+		Returns the file name where the sample is saved in.
+		"""
+		return self.get_state_filename("sample")
+
 	def load_sample(self):
 		"""
 		Returns the last saved sample as string.
@@ -229,10 +340,139 @@ class BaseStrategy:
 			)
 		chmod(file_name, 0 | stat.S_IRUSR | stat.S_IWUSR)
 
+	def load_state(self, extension):
+		"""
+		Returns the last saved state of kind ``extension`` as dict
+		(empty if there is none).
+		"""
+		from json import load as json_load
+		try:
+			with open(self.get_state_filename(extension), 'r',
+						encoding='utf8') as file_object:
+				return json_load(file_object)
+		except (IOError, ValueError):
+			return dict()
+
+	def save_state(self, extension, state):
+		"""
+		Saves a state (JSON serializable dict) of kind ``extension``
+		to file.
+		"""
+		from json import dump as json_dump
+		file_name = self.get_state_filename(extension)
+		dir_name = dirname(file_name)
+		if not isdir(dir_name):
+			makedirs(
+				dir_name,
+				0 | stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
+			)
+		with open(file_name, 'w', encoding='utf8') as file_object:
+			json_dump(state, file_object)
+		chmod(file_name, 0 | stat.S_IRUSR | stat.S_IWUSR)
+
+class BatchStrategy(BaseStrategy):
+	"""
+	Checks all targets a section expands to in one batch.
+	The targets are expanded not before checking and are checked by the
+	strategy chosen for the first of them.
+	"""
+
+	message = None
+	success = False
+
+	# number of targets checked at once, so that not all strategies of
+	# (potentially large) expansions exist at the same time
+	CHUNK_SIZE = 64
+
+	_released_attributes = ('failed_members', )
+
+	def __init__(self, global_options, section, options, member_class):
+		super(BatchStrategy, self).__init__(global_options, section, options)
+		self.member_class = member_class
+		self.member_count = 0
+		self.failed_members = []
+
+	@classmethod
+	def get_help(cls):
+		return 'Checks all targets a section expands to.'
+
+	def get_members(self):
+		"""
+		Generator that yields one strategy per target of the section.
+		"""
+		for target_str in expand_target(self._options['target_expansion']):
+			options = OptionsDict(self.options)
+			options.pop('target_expansion', None)
+			options.pop('strategy', None)
+			options['parsed_target'] = parse_target(target_str)
+			yield self.member_class(
+				self.global_options,
+				"%s[%s]" % (self.section, target_str),
+				options,
+			)
+
+	def do_check(self):
+		debug("checking targets of '%s' in batches of %i" % (
+			self.section, self.CHUNK_SIZE
+		))
+		self.member_count = 0
+		self.failed_members = []
+		members = self.get_members()
+		chunk = list(islice(members, self.CHUNK_SIZE))
+		while chunk:
+			self.member_class.do_check_batch(chunk, self._throttle_member)
+			for member in chunk:
+				if member.get_last_check_success():
+					member.release()
+				else:
+					self.failed_members.append(member)
+			chunk = list(islice(members, self.CHUNK_SIZE))
+		self.success = not self.failed_members
+
+	def _throttle_member(self):
+		"""
+		Counts the members checked and throttles the connections of all
+		but the first one, which uses the connection granted for the
+		section (see set_connection_throttle).
+		"""
+		if self.member_count and self._connection_throttle:
+			self._connection_throttle()
+		self.member_count += 1
+
+	def get_result(self, started=None, duration=None):
+		result = super(BatchStrategy, self).get_result(started, duration)
+		return result.replace(strategy=self.member_class.__name__)
+
+	def get_mail_subject(self):
+		return "%s checking '%s' (%i of %i targets failed)!" % (
+			'Success' if self.success else 'Error',
+			self.section,
+			len(self.failed_members),
+			self.member_count,
+		)
+
+	def get_mail_message(self):
+		delimiter = "\n\n%s\n\n" % ("-"*80)
+		return delimiter.join([self.get_mail_subject()] + [
+			''.join(("--- ", m.get_mail_subject(), " ---\n",
+					m.get_mail_message()))
+			for m in self.failed_members
+		])
+
+	def get_last_check_success(self):
+		return self.success
+
 class DeviationCheckMixin(object):
 
+	fingerprint = None
+
 	def check_deviation(self, new_sample):
 
+		self.fingerprint = None
+		if new_sample is not None:
+			from hashlib import sha1
+			self.fingerprint = sha1(new_sample).hexdigest()
+
 		if not self.success:
 			return
 
@@ -269,3 +509,68 @@ class DeviationCheckMixin(object):
 
 		self.success &= deviation <= max_deviation
 		self.message += "\n\n" + additional_message
+
+class ConnectionCheckMixin(object):
+	"""
+	Reports how the connection to the target has been established and
+	optionally fails if an address family is broken (see lib.net).
+	"""
+
+	OPTION_REQUIRE_ALL_FAMILIES = 'require_all_address_families'
+
+	connection_report = None
+
+	def check_connection(self):
+
+		report = self.connection_report
+		if report is None or report.family is None:
+			return
+
+		self.message += "\n" + report.describe()
+
+		broken_families = report.get_broken_families()
+		if broken_families and self.options.get_bool(
+			self.OPTION_REQUIRE_ALL_FAMILIES
+		):
+			self.success = False
+
+class CertificateCheckMixin(object):
+	"""
+	Reports the certificate of TLS targets and optionally fails if it
+	expires soon (see lib.net.get_certificate_info).
+	"""
+
+	OPTION_MIN_CERT_DAYS = 'min_cert_days'
+
+	certificate_info = None
+
+	def check_certificate(self):
+
+		if not self.success:
+			return
+
+		try:
+			min_days = self.options.get_float(self.OPTION_MIN_CERT_DAYS, -1)
+		except (TypeError, ValueError):
+			min_days = -1
+
+		info = self.certificate_info
+		if info is None:
+			if min_days >= 0:
+				self.message += "\nno verified certificate available"
+				self.success = False
+			return
+
+		days_left = (info['not_after'] - time()) / 86400
+		additional_message = "certificate for %s by %s expires in %.1f days" % (
+			info['subject'], info['issuer'], days_left
+		)
+		if info.get('session_reused'):
+			additional_message += " (TLS session resumed)"
+		if days_left < min_days:
+			additional_message += " (min %.1f days)" % min_days
+			self.success = False
+
+		debug(additional_message)
+
+		self.message += "\n" + additional_message
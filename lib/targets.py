@@ -0,0 +1,76 @@
+"""
+Module provides parsing of targets and the expansion of section names
+that describe multiple targets.
+
+Supported expansions:
+	10.0.0.0/24							all hosts in the network
+	http://web{01..50}.example.com/		numeric ranges (zero padding is kept)
+
+Sections must not expand to more than MAX_TARGETS targets.
+"""
+
+from re import compile as re_compile
+from urllib.parse import urlparse
+
+# maximum number of targets a section may expand to
+MAX_TARGETS = 4096
+
+RANGE_PATTERN = re_compile(r'\{(\d+)\.\.(\d+)\}')
+NETWORK_PATTERN = re_compile(
+	r'^(\d{1,3}(\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:]*)/\d{1,3}$'
+)
+
+def parse_target(target_str):
+	"""
+	Transforms a target string into a ParseResult.
+	"""
+	if "//" not in target_str:
+		target_str = "//" + target_str
+	return urlparse(target_str)
+
+def is_expandable(target_str):
+	"""
+	Returns if a target string describes multiple targets.
+	"""
+	return bool(
+		NETWORK_PATTERN.match(target_str) or RANGE_PATTERN.search(target_str)
+	)
+
+def count_targets(target_str):
+	"""
+	Returns (w/o expanding) how many targets a target string describes
+	at most.
+	"""
+	if NETWORK_PATTERN.match(target_str):
+		from ipaddress import ip_network
+		return ip_network(target_str, strict=False).num_addresses
+	count = 1
+	for first_str, last_str in RANGE_PATTERN.findall(target_str):
+		count *= abs(int(last_str) - int(first_str)) + 1
+	return count
+
+def expand_target(target_str):
+	"""
+	Generator that yields all targets described by a target string.
+	Yields the target string itself if there is nothing to expand.
+	"""
+	if NETWORK_PATTERN.match(target_str):
+		from ipaddress import ip_network
+		for address in ip_network(target_str, strict=False).hosts():
+			yield str(address)
+		return
+
+	match = RANGE_PATTERN.search(target_str)
+	if not match:
+		yield target_str
+		return
+
+	first_str, last_str = match.groups()
+	first, last = int(first_str), int(last_str)
+	width = len(first_str) if first_str.startswith('0') else 0
+	step = 1 if last >= first else -1
+	prefix, suffix = target_str[:match.start()], target_str[match.end():]
+	for number in range(first, last + step, step):
+		# expand further ranges in the remainder recursively
+		for expanded_suffix in expand_target(suffix):
+			yield "%s%0*d%s" % (prefix, width, number, expanded_suffix)
@@ -2,7 +2,7 @@
 Module for everything that does not fit into one of the other modules.
 """
 
-from inspect import stack
+from sys import stderr
 
 COLOR_STD = '\033[0m'
 COLOR_FAIL = '\033[31m'
@@ -11,7 +11,9 @@ COLOR_LIGHT = '\033[33m'
 def debug(msg):
 	"""
 	helper method to honor __debug__ for debug printing
+	(to stderr, so that it does not mix with results on stdout)
 	"""
 	if __debug__:
+		from inspect import stack
 		depth = len(stack()) - 3
-		print(' '*depth, msg)
+		print(' '*depth, msg, file=stderr)
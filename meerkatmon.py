@@ -3,16 +3,42 @@
 This moduly mainly provides CLI interface to class MeerkatMon.
 """
 
-from sys import argv
+from sys import argv, stdout, stderr
 
 from lib.base import MeerkatMon
+from lib.results import NdjsonWriter
+
+def pop_option(name):
+	"""
+	Removes option ``name`` (given as ``--name VALUE`` or
+	``--name=VALUE``) from argv and returns its value (``None`` if
+	absent).
+	"""
+	for index, argument in enumerate(argv):
+		if argument == name and index + 1 < len(argv):
+			value = argv[index + 1]
+			del argv[index:index + 2]
+			return value
+		if argument.startswith(name + '='):
+			del argv[index]
+			return argument[len(name) + 1:]
+	return None
 
 if __name__ == "__main__":
 	if '--help' in argv or '-h' in argv:
 		print("MeerkatMon - gawky script for monitoring services")
 		print("")
-		print("usage: [python3] ./meerkatmon.py [config file]")
+		print("usage: [python3] ./meerkatmon.py [--persistent SECONDS [--control-socket PATH]]")
+		print("	[--output mail|ndjson|mail,ndjson] [--output-file FILE] [config file]")
 		print("	python3		turns on debug")
+		print("	--persistent	keep running, check every SECONDS and")
+		print("			reload changed sections of the config file")
+		print("	--control-socket	accept commands at this Unix domain socket")
+		print("			(see ./meerkatmonctl.py --help)")
+		print("	--output	how to report results (default: mail);")
+		print("			ndjson writes one JSON object per section")
+		print("			as soon as its check finished")
+		print("	--output-file	file to append ndjson to (default: stdout)")
 		print("	config file	defaults to './meerkatmon.conf'")
 		print("")
 		print("Global configuration options:\n")
@@ -42,8 +68,27 @@ if __name__ == "__main__":
 		print("\nproject page: https://github.com/lpirl/meerkatmon")
 		print("Happy peeking!")
 		exit(0)
+	persistent_interval = pop_option('--persistent')
+	control_socket = pop_option('--control-socket')
+	if control_socket and not persistent_interval:
+		print("ERROR: --control-socket requires --persistent", file=stderr)
+		exit(1)
+	outputs = (pop_option('--output') or 'mail').split(',')
+	output_file = pop_option('--output-file')
 	try:
 		monitor = MeerkatMon(argv[1])
 	except IndexError as exception:
 		monitor = MeerkatMon()
-	monitor.auto()
+	for output in outputs:
+		if output not in ('mail', 'ndjson'):
+			print("ERROR: unknown output '%s'" % output, file=stderr)
+			exit(1)
+	monitor.mail = 'mail' in outputs
+	if 'ndjson' in outputs:
+		monitor.add_result_handler(NdjsonWriter(
+			open(output_file, 'a') if output_file else stdout
+		))
+	if persistent_interval:
+		monitor.persistent(float(persistent_interval), control_socket)
+	else:
+		monitor.auto()
@@ -0,0 +1,40 @@
+#!/usr/bin/env -S python3 -OO
+"""
+This module provides a CLI client for the control socket of a
+MeerkatMon running in persistent mode.
+"""
+
+from sys import argv
+from json import dumps
+
+from lib.control import COMMANDS, send_request
+
+if __name__ == "__main__":
+	if '--help' in argv or '-h' in argv or len(argv) < 3:
+		print("MeerkatMon control - talk to a persistent MeerkatMon")
+		print("")
+		print("usage: ./meerkatmonctl.py SOCKET COMMAND [SECTION ...]")
+		print("	SOCKET		path given to meerkatmon.py --control-socket")
+		print("	COMMAND		one of:")
+		print("			check SECTION ...	check sections now")
+		print("			check-failing		check all failing sections now")
+		print("			dump			show last results and all sections")
+		print("")
+		print("exit status: 0 if all results are successful, 1 if not, 2 on errors")
+		exit(0 if '--help' in argv or '-h' in argv else 2)
+
+	socket_path, command, sections = argv[1], argv[2], argv[3:]
+	if command not in COMMANDS:
+		print("ERROR: unknown command '%s'" % command)
+		exit(2)
+
+	try:
+		response = send_request(socket_path, command, sections)
+	except OSError as error:
+		print("ERROR: could not talk to '%s': %s" % (socket_path, error))
+		exit(2)
+
+	print(dumps(response, indent=2, sort_keys=True))
+	if 'error' in response:
+		exit(2)
+	exit(0 if all(r['success'] for r in response['results']) else 1)
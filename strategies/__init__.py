@@ -1,3 +1,40 @@
-from .ping import Ping
-from .http import Http
-from .smtp import Smtp
+"""
+Strategies are imported lazily, i.e., only if they are needed to check
+the targets in the config.
+
+``STRATEGIES`` maps the names of all strategies to their modules and to
+the URL schemes they can check (``None`` if not limited to schemes).
+"""
+
+from importlib import import_module
+
+STRATEGIES = {
+	'Http': ('.http', ('http', 'https', )),
+	'Ping': ('.ping', None),
+	'Smtp': ('.smtp', ('smtp', 'smtps', )),
+}
+
+def get_strategy(name):
+	"""
+	Imports and returns the strategy (class) with the given name.
+	"""
+	module_name, _ = STRATEGIES[name]
+	return getattr(import_module(module_name, __name__), name)
+
+def get_strategies(scheme=None):
+	"""
+	Imports and returns all strategies (classes), or, if a ``scheme`` is
+	given, only those which might be able to check targets with it.
+	"""
+	return [
+		get_strategy(name) for name, (_, schemes) in sorted(STRATEGIES.items())
+		if scheme is None or schemes is None or scheme in schemes
+	]
+
+def __getattr__(name):
+	"""
+	Keeps ``from strategies import Http`` etc. working.
+	"""
+	if name in STRATEGIES:
+		return get_strategy(name)
+	raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
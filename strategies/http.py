@@ -1,24 +1,169 @@
 #!/usr/bin/env python
-from urllib.request import Request, urlopen as urllib_urlopen
+from urllib.request import Request, build_opener, HTTPHandler, HTTPSHandler
 from urllib.error import HTTPError, URLError
 from socket import error as socket_error
 from ssl import SSLError, CertificateError
+import stat
+from hashlib import sha1
+from os import chmod
+from zlib import decompressobj, error as ZlibError, MAX_WBITS
 from lib.strategies import (	BaseStrategy, DeviationCheckMixin,
+								ConnectionCheckMixin, CertificateCheckMixin,
 								KNOWLEDGE_ALIVE,
 								KNOWLEDGE_NONE )
+from lib.net import (	happy_eyeballs, ConnectionReport, get_tls_context,
+						get_tls_session, remember_tls_session,
+						get_certificate_info )
 from lib.util import (	debug,
 						COLOR_LIGHT,
 						COLOR_STD )
 from http.client import (	BadStatusLine, HTTPResponse, RemoteDisconnected,
-													IncompleteRead)
+													IncompleteRead, HTTPConnection, HTTPSConnection)
 
-class Http(BaseStrategy, DeviationCheckMixin):
+try:
+	from brotli import Decompressor as BrotliDecompressor
+except ImportError:
+	BrotliDecompressor = None
+
+# older versions of brotli cannot limit the output of a decompression
+# step (i.e., cannot resist decompression bombs), so they are not used
+if not hasattr(BrotliDecompressor, 'can_accept_more_data'):
+	BrotliDecompressor = None
+
+READ_CHUNK_SIZE = 64 * 1024
+
+class ResponseTooLarge(Exception):
+	"""
+	Raised if a (decompressed) response body exceeds the configured limit.
+	"""
+
+class BrotliDecompressObj(object):
+	"""
+	Wraps brotli's decompressor to resemble zlib's decompress objects.
+	"""
+
+	def __init__(self):
+		self._decompressor = BrotliDecompressor()
+		self.unconsumed_tail = b''
+
+	def decompress(self, data, max_length=0):
+		"""
+		Decompresses ``data`` to at most ``max_length`` bytes (unlimited
+		if 0). If brotli holds back input because of the limit,
+		``unconsumed_tail`` is the last ``data`` passed (brotli buffers
+		the input itself, so it must not be passed again).
+		"""
+		if max_length:
+			output = self._decompressor.process(
+				data, output_buffer_limit=max_length
+			)
+		else:
+			output = self._decompressor.process(data)
+		if self._decompressor.can_accept_more_data():
+			self.unconsumed_tail = b''
+		else:
+			self.unconsumed_tail = data or self.unconsumed_tail
+		return output
+
+class RacingConnectionMixin(object):
+	"""
+	Makes connections of http.client race the addresses of the host
+	(see lib.net.happy_eyeballs).
+	"""
+
+	tls_socket = None
+	certificate_info = None
+
+	def __init__(self, *args, **kwargs):
+		super(RacingConnectionMixin, self).__init__(*args, **kwargs)
+		self.connection_report = ConnectionReport()
+		self._create_connection = self._race
+
+	def _race(self, address, timeout, source_address=None):
+		return happy_eyeballs(
+			address, timeout, source_address, self.connection_report
+		)
+
+	def remember_tls_session(self):
+		"""
+		Remembers the TLS session (if any) for subsequent connections.
+		"""
+		if self.tls_socket is not None:
+			remember_tls_session(
+				self._context, (self.host, self.port), self.tls_socket
+			)
+
+class RacingHTTPConnection(RacingConnectionMixin, HTTPConnection):
+	pass
+
+class RacingHTTPSConnection(RacingConnectionMixin, HTTPSConnection):
+	"""
+	Additionally resumes TLS sessions and collects certificate info.
+	"""
+
+	def connect(self):
+		HTTPConnection.connect(self)
+		server_hostname = self._tunnel_host or self.host
+		key = (self.host, self.port)
+		self.sock = self._context.wrap_socket(
+			self.sock,
+			server_hostname=server_hostname,
+			session=get_tls_session(self._context, key),
+		)
+		self.tls_socket = self.sock
+		self.certificate_info = get_certificate_info(key, self.sock)
+
+class RacingHTTPHandler(HTTPHandler):
+	"""
+	Opens racing connections and collects them in ``connections``.
+	"""
+
+	def __init__(self, connections):
+		super(RacingHTTPHandler, self).__init__()
+		self.connections = connections
+
+	def _connection(self, host, **kwargs):
+		connection = RacingHTTPConnection(host, **kwargs)
+		self.connections.append(connection)
+		return connection
+
+	def http_open(self, request):
+		return self.do_open(self._connection, request)
+
+class RacingHTTPSHandler(HTTPSHandler):
+	"""
+	Opens racing connections and collects them in ``connections``.
+	"""
+
+	def __init__(self, connections):
+		super(RacingHTTPSHandler, self).__init__(context=get_tls_context())
+		self.connections = connections
+
+	def _connection(self, host, **kwargs):
+		connection = RacingHTTPSConnection(host, **kwargs)
+		self.connections.append(connection)
+		return connection
+
+	def https_open(self, request):
+		return self.do_open(self._connection, request, context=self._context)
+
+class Http(BaseStrategy, DeviationCheckMixin, ConnectionCheckMixin,
+			CertificateCheckMixin):
 
 	OPTION_MAX_DEVIATION = 'max_size_deviation_percentage'
 	OPTION_STATUS_CODE = 'status_code'
 	OPTION_CHECK_SSL_TOO = 'check_SSL_too'
 	OPTION_PRESENT_IN_RESPONSE = 'present_in_response'
 	OPTION_ABSENT_IN_RESPONSE = 'absent_in_response'
+	OPTION_CONDITIONAL_REQUEST = 'conditional_request'
+	OPTION_MAX_RESPONSE_SIZE = 'max_response_size'
+	OPTION_REQUEST_METHOD = 'request_method'
+
+	STATE_VALIDATORS = 'validators'
+	# whether the server refused HEAD requests (see _is_head_refused())
+	STATE_HEAD_REFUSED = 'head_refused'
+	# raw body of the last successful response, reused on a 304
+	STATE_BODY = 'body'
 
 	_options_help = {
 		OPTION_MAX_DEVIATION: ('test fails if response deviates too much in size ' +
@@ -28,11 +173,88 @@ class Http(BaseStrategy, DeviationCheckMixin):
 		OPTION_CHECK_SSL_TOO: 'for HTTP targets, check target using HTTPS as well',
 		OPTION_PRESENT_IN_RESPONSE: 'test fails if given string not in response',
 		OPTION_ABSENT_IN_RESPONSE: 'test fails if given string in response',
+		OPTION_CONDITIONAL_REQUEST: ('if True (default), ask the server to omit ' +
+																'the body if unchanged since the last check'),
+		OPTION_MAX_RESPONSE_SIZE: ('test fails if the (decompressed) response ' +
+																'exceeds this many bytes (default 10 MiB)'),
+		OPTION_REQUEST_METHOD: ('GET, HEAD or auto (default: HEAD if the ' +
+														'response body is not checked, GET otherwise)'),
+		ConnectionCheckMixin.OPTION_REQUIRE_ALL_FAMILIES: ('test fails if ' +
+														'connecting via IPv4 or IPv6 fails while the ' +
+														'other works'),
+		CertificateCheckMixin.OPTION_MIN_CERT_DAYS: ('for HTTPS targets, test ' +
+														'fails if the certificate expires in less ' +
+														'days'),
 	}
 
+	# options which require the response body to be checked
+	BODY_OPTIONS = (
+		OPTION_PRESENT_IN_RESPONSE,
+		OPTION_ABSENT_IN_RESPONSE,
+		OPTION_MAX_DEVIATION,
+	)
+
+	ACCEPT_ENCODING = ', '.join(
+		('gzip', 'deflate') + (('br', ) if BrotliDecompressor else ())
+	)
+
 	message = None
 	success = False
 	response_str = None
+	not_modified = False
+	validators = None
+	stored_body = None
+	received_bytes = 0
+	body_bytes = 0
+	request_method = 'GET'
+	head_fallback = False
+	head_refused = None
+	used_method = None
+	response_code = None
+	request_message = None
+
+	_released_attributes = ('message', 'request_message', 'response_str',
+							'validators', 'stored_body')
+
+	# attributes describing the response, see do_check_shared()
+	_shared_attributes = ('response_code', 'request_message', 'response_str',
+							'not_modified', 'validators', 'used_method',
+							'received_bytes', 'body_bytes', 'connection_report',
+							'certificate_info')
+
+	def __init__(self, *args, **kwargs):
+		super(Http, self).__init__(*args, **kwargs)
+		self.request_method, self.head_fallback = self._get_request_method()
+
+	def _get_request_method(self):
+		"""
+		Determines (once, when the config is loaded) whether the body of
+		responses is needed at all.
+		Returns the request method and whether to fall back to GET if
+		the server refuses HEAD.
+		"""
+		method = str(self.options.get(self.OPTION_REQUEST_METHOD, 'auto'))
+		method = method.strip().upper()
+		if method in ('GET', 'HEAD'):
+			return method, False
+		if method != 'AUTO':
+			raise ValueError(
+				"Section '%s': unknown %s '%s'" % (
+					self.section, self.OPTION_REQUEST_METHOD, method
+				)
+			)
+		options = self.options
+		for option in self.BODY_OPTIONS:
+			if option not in options:
+				continue
+			if option == self.OPTION_MAX_DEVIATION:
+				try:
+					if options.get_float(option) < 0:
+						continue
+				except (TypeError, ValueError):
+					continue
+			return 'GET', False
+		return 'HEAD', True
 
 	def target_knowledge(self):
 		if self.target.scheme.lower() in ("http", "https", ):
@@ -47,33 +269,244 @@ class Http(BaseStrategy, DeviationCheckMixin):
 		return 'Used for HTTP targets.'
 
 	@classmethod
-	def urlopen(cls, url, *args, **kwargs):
+	def urlopen(cls, url, *args, headers=None, method=None, connections=None,
+				**kwargs):
 		"""
-		Wraps 'urlopen' provided by 'urllib' to set own user agent.
+		Wraps 'urlopen' provided by 'urllib' to set own user agent
+		(and additional ``headers`` and the ``method``, if provided).
+		Connections race the addresses of the host and are appended to
+		``connections``, if provided.
 		"""
+		if connections is None:
+			connections = []
+		request_headers = {
+			'User-Agent' : 'MeerkatMon (https://github.com/lpirl/meerkatmon)',
+			'Accept-Encoding': cls.ACCEPT_ENCODING,
+		}
+		request_headers.update(headers or dict())
 		request = Request(
 			url,
 			None,
-			{ 'User-Agent' : 'MeerkatMon (https://github.com/lpirl/meerkatmon)' }
+			request_headers,
+			method=method
+		)
+		opener = build_opener(
+			RacingHTTPHandler(connections),
+			RacingHTTPSHandler(connections),
+		)
+		return opener.open(request, *args, **kwargs)
+
+	def _load_body(self):
+		"""
+		Returns the raw body saved during the last successful check
+		(``None`` if there is none).
+		"""
+		try:
+			with open(self.get_state_filename(self.STATE_BODY), 'rb') as f:
+				return f.read()
+		except IOError:
+			return None
+
+	def _save_body(self, body):
+		"""
+		Saves the raw body (bytes) of a response (call after save_state,
+		which creates the directory).
+		"""
+		file_name = self.get_state_filename(self.STATE_BODY)
+		with open(file_name, 'wb') as f:
+			f.write(body)
+		chmod(file_name, 0 | stat.S_IRUSR | stat.S_IWUSR)
+
+	def _get_conditional_headers(self):
+		"""
+		Returns headers to make the request conditional on the
+		validators saved during the last successful check.
+		Empty if the saved body cannot be reproduced exactly (i.e., there
+		is nothing to fall back to on a 304), sets self.stored_body
+		otherwise.
+		"""
+		self.stored_body = None
+		if not self.options.get_bool(self.OPTION_CONDITIONAL_REQUEST, True):
+			return dict()
+		validators = self.load_state(self.STATE_VALIDATORS)
+		if not validators or 'fingerprint' not in validators:
+			return dict()
+		body = self._load_body()
+		if (	body is None or len(body) != validators.get('size') or
+				sha1(body).hexdigest() != validators['fingerprint'] ):
+			debug("saved body does not match validators, not conditional")
+			return dict()
+		self.stored_body = body
+		headers = dict()
+		if validators.get('etag'):
+			headers['If-None-Match'] = validators['etag']
+		if validators.get('last_modified'):
+			headers['If-Modified-Since'] = validators['last_modified']
+		return headers
+
+	def _update_validators(self, response):
+		"""
+		Remembers validators (``ETag``, ``Last-Modified``) sent by the
+		server, to be saved if the check succeeds.
+		"""
+		response_headers = getattr(response, "headers", None)
+		if response_headers is None:
+			return
+		validators = {
+			'etag': response_headers.get('ETag'),
+			'last_modified': response_headers.get('Last-Modified'),
+		}
+		if any(validators.values()):
+			self.validators = validators
+
+	@classmethod
+	def _get_decompressor(cls, encoding, first_chunk):
+		"""
+		Returns a zlib-like decompress object for the given
+		``Content-Encoding`` (``None`` if identity).
+		"""
+		encoding = (encoding or 'identity').strip().lower()
+		if encoding in ('identity', ''):
+			return None
+		if encoding in ('gzip', 'x-gzip'):
+			return decompressobj(16 + MAX_WBITS)
+		if encoding == 'deflate':
+			# some servers send raw deflate streams w/o zlib header
+			if first_chunk and first_chunk[0] & 0x0F == 8:
+				return decompressobj(MAX_WBITS)
+			return decompressobj(-MAX_WBITS)
+		if encoding == 'br' and BrotliDecompressor:
+			return BrotliDecompressObj()
+		raise ZlibError("unsupported content encoding '%s'" % encoding)
+
+	def _read_body(self, response):
+		"""
+		Reads and decompresses ``response`` chunk by chunk while
+		enforcing the maximum response size.
+		Sets self.{received_bytes, body_bytes} and returns the body.
+		"""
+		max_size = self.options.get_int(self.OPTION_MAX_RESPONSE_SIZE,
+																		10 * 1024 * 1024)
+		encoding = response.headers.get('Content-Encoding')
+		decompressor = None
+		chunks = []
+		received_bytes = 0
+		body_bytes = 0
+
+		chunk = response.read(READ_CHUNK_SIZE)
+		if chunk:
+			decompressor = self._get_decompressor(encoding, chunk)
+		while chunk:
+			received_bytes += len(chunk)
+			if decompressor:
+				# ask for at most one byte more than allowed
+				data = decompressor.decompress(chunk, max_size - body_bytes + 1)
+				if decompressor.unconsumed_tail:
+					raise ResponseTooLarge()
+			else:
+				data = chunk
+			body_bytes += len(data)
+			if body_bytes > max_size:
+				raise ResponseTooLarge()
+			chunks.append(data)
+			chunk = response.read(READ_CHUNK_SIZE)
+
+		if decompressor and hasattr(decompressor, 'flush'):
+			data = decompressor.flush()
+			body_bytes += len(data)
+			if body_bytes > max_size:
+				raise ResponseTooLarge()
+			chunks.append(data)
+
+		self.received_bytes = received_bytes
+		self.body_bytes = body_bytes
+		return b''.join(chunks)
+
+	def _open(self, method, headers, connections, read_body=True):
+		"""
+		Sends a request with ``method`` to the target.
+		Returns the response (or the error) and, unless HEAD or not
+		``read_body``, the body (the response is closed after the
+		headers otherwise).
+		"""
+		response_str = None
+		try:
+			response = Http.urlopen(
+				self.target.geturl(),
+				timeout = self.options.get_int('timeout', 5),
+				headers = headers,
+				method = method,
+				connections = connections
+			)
+			try:
+				if method != 'HEAD' and read_body:
+					response_str = self._read_body(response)
+			finally:
+				connections[-1].remember_tls_session()
+				response.close()
+		except (HTTPError, SSLError, BadStatusLine, IncompleteRead,
+						CertificateError) as e:
+			response = e
+		return response, response_str
+
+	def get_request_key(self):
+		options = self.options
+		return (
+			self.__class__.__name__,
+			self.target.geturl(),
+			options.get('timeout'),
+			self.request_method,
+			self.head_fallback,
+			options.get(self.OPTION_MAX_RESPONSE_SIZE),
+			options.get_bool(self.OPTION_CONDITIONAL_REQUEST, True),
 		)
-		return urllib_urlopen(request, *args, **kwargs)
+
+	def _is_head_refused(self):
+		"""
+		Returns whether the server refused HEAD requests before (kept
+		in state, so that it is not asked again on every check).
+		"""
+		if self.head_refused is None:
+			self.head_refused = bool(
+				self.load_state(self.STATE_HEAD_REFUSED).get('refused')
+			)
+		return self.head_refused
 
 	def _do_request(self):
 		"""
 		Method does actually speak with the target and sets
-		self.{message, success, response_str} accordingly.
+		self.{request_message, response_code, response_str} accordingly.
 		"""
 		response_str = None
+		not_modified = False
+		self.validators = None
+		self.received_bytes = 0
+		self.body_bytes = 0
+		connections = []
+		method = self.request_method
+		# status only sections fall back to GET, but never read the body
+		status_only = self.head_fallback
+		if status_only and self._is_head_refused():
+			method = 'GET'
+		if method == 'GET' and not status_only:
+			conditional_headers = self._get_conditional_headers()
+		else:
+			conditional_headers = dict()
 		try:
-			try:
-				response = Http.urlopen(
-					self.target.geturl(),
-					timeout = self.options.get_int('timeout', 5)
-				)
-				response_str = response.read()
-			except (HTTPError, SSLError, BadStatusLine, IncompleteRead,
-							CertificateError) as e:
-				response = e
+			response, response_str = self._open(method, conditional_headers,
+												connections, not status_only)
+
+			if (status_only and method == 'HEAD' and
+					getattr(response, "code", None) in (405, 501)):
+				debug("server refused HEAD, falling back to GET")
+				method = 'GET'
+				self.head_refused = True
+				self.save_state(self.STATE_HEAD_REFUSED, {'refused': True})
+				response, response_str = self._open(method, dict(), connections,
+													False)
+
+			if method == 'GET' and not status_only:
+				self._update_validators(response)
 
 			response_message = getattr(response, "msg", None)
 			if response_message is None:
@@ -81,23 +514,44 @@ class Http(BaseStrategy, DeviationCheckMixin):
 			else:
 				message = "message from server: '%s'" % response_message
 
+			if response_str is not None:
+				message += "\nreceived %i bytes (%i bytes decoded)" % (
+					self.received_bytes, self.body_bytes
+				)
+
 			response_code = getattr(response, "code", None)
 
-			success = response_code == self.options.get_int(
-				self.OPTION_STATUS_CODE, 200
-			)
+			if response_code == 304 and conditional_headers:
+				# unchanged since last successful check: reuse last body
+				not_modified = True
+				response_str = self.stored_body
+				message = "not modified since last check (%s)" % message
+
+		except ResponseTooLarge:
+			response_code = None
+			message = "response exceeds %i bytes (after decompression)" % \
+				self.options.get_int(self.OPTION_MAX_RESPONSE_SIZE, 10 * 1024 * 1024)
+
+		except ZlibError as e:
+			response_code = None
+			message = "could not decompress response: %s" % e
 
 		except URLError as e:
-			success = False
+			response_code = None
 			message = str(e.reason)
 
 		except socket_error as e:
-			success = False
+			response_code = None
 			message = str(type(e)) + ": " + str(e)
 
-		self.message = message
-		self.success = success
+		self.request_message = message
+		self.response_code = response_code
+		connection = connections[-1] if connections else None
+		self.connection_report = getattr(connection, 'connection_report', None)
+		self.certificate_info = getattr(connection, 'certificate_info', None)
 		self.response_str = response_str
+		self.not_modified = not_modified
+		self.used_method = method
 
 	def _check_response_content(self):
 		additional_message = ""
@@ -118,20 +572,48 @@ class Http(BaseStrategy, DeviationCheckMixin):
 			self.message += additional_message
 			self.success = False
 
+	def _check_status(self):
+		"""
+		Sets self.{message, success} according to the response.
+		"""
+		self.message = self.request_message
+		self.success = self.not_modified or self.response_code == \
+			self.options.get_int(self.OPTION_STATUS_CODE, 200)
+
 	def do_check(self):
 		"""
 		Method coordinates check.
 		"""
 		self._do_request()
+		self._evaluate()
+
+	def _evaluate(self):
+		"""
+		Runs all checks on the response.
+		"""
+		self._check_status()
+		self.check_connection()
+		if self.target.scheme.lower() == 'https':
+			self.check_certificate()
 
 		debug("%sreached\n\n'%s'\n" % (
 			'NOT ' if not self.success else '',
 			''.join([COLOR_LIGHT, self.message, COLOR_STD])
 		))
 
+		self.fingerprint = None
 		if self.response_str is not None:
 			self._check_response_content()
-		self.check_deviation(self.response_str)
+			self.check_deviation(self.response_str)
+
+		if self.success and self.validators and self.response_str is not None:
+			self.save_state(self.STATE_VALIDATORS, dict(
+				self.validators,
+				size=len(self.response_str),
+				fingerprint=sha1(self.response_str).hexdigest(),
+			))
+			if not self.not_modified:
+				self._save_body(self.response_str)
 
 	def get_mail_message(self):
 		try:
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
-from subprocess import check_output, CalledProcessError, STDOUT
+from re import compile as re_compile
+from subprocess import Popen, PIPE, STDOUT
 
 from lib.strategies import (	BaseStrategy,
 								KNOWLEDGE_EXISTS,
@@ -8,8 +9,44 @@ from lib.util import (	debug,
 						COLOR_LIGHT,
 						COLOR_STD )
 
+# round trip time of a reply, e.g. "64 bytes from ...: ... time=0.05 ms"
+RTT_PATTERN = re_compile(r'time[=<]([0-9.]+) ?ms')
+
 class Ping(BaseStrategy):
 
+	# maximum number of ping processes running at once
+	MAX_PARALLEL = 64
+
+	# ping processes currently running (a set, as checks may run in
+	# threads, see lib.executor)
+	_running = set()
+
+	_released_attributes = ('output', 'statistics')
+
+	# attributes describing the response, see do_check_shared()
+	_shared_attributes = ('output', 'returncode')
+
+	OPTION_COUNT = 'count'
+	OPTION_PING_INTERVAL = 'ping_interval'
+	OPTION_MAX_LOSS = 'max_loss_percent'
+	OPTION_MAX_RTT = 'max_rtt_ms'
+
+	_options_help = {
+		OPTION_COUNT: 'number of probes to send (default: 1)',
+		OPTION_PING_INTERVAL: ('seconds between probes if sending more than ' +
+								'one (default: 0.2)'),
+		OPTION_MAX_LOSS: 'test fails if more probes are lost (percentage)',
+		OPTION_MAX_RTT: ('test fails if the average round trip time is ' +
+							'higher (milliseconds)'),
+	}
+
+	output = None
+	returncode = None
+	statistics = None
+	success = False
+	message = None
+
+	_process = None
 
 	@classmethod
 	def get_help(cls):
@@ -23,35 +60,150 @@ class Ping(BaseStrategy):
 			return KNOWLEDGE_EXISTS
 		return KNOWLEDGE_NONE
 
-	def do_check(self):
-		cmd = [
+	def get_request_key(self):
+		return (
+			self.__class__.__name__,
+			self.target.netloc,
+			self.options.get('timeout', '5'),
+			self.options.get(self.OPTION_COUNT, '1'),
+			self.options.get(self.OPTION_PING_INTERVAL, '0.2'),
+		)
+
+	def _get_command(self):
+		command = [
 			self.which('ping'),
 			'-W', self.options.get('timeout', '5'),
-			'-c', self.options.get('count', '1'),
-			self.target.netloc
+			'-c', self.options.get(self.OPTION_COUNT, '1'),
 		]
+		if self.options.get_int(self.OPTION_COUNT, 1) > 1:
+			command += ['-i', self.options.get(self.OPTION_PING_INTERVAL, '0.2')]
+		return command + [self.target.netloc]
 
+	def _start(self):
+		"""
+		Starts pinging the target w/o waiting for the result.
+		"""
+		cmd = self._get_command()
 		debug("running command: %s" % str(cmd))
+		self._process = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+		Ping._running.add(self._process)
 
-		success = True
+	def _finish(self):
+		"""
+		Waits for a ping started with _start and evaluates the result.
+		"""
+		process, self._process = self._process, None
 		try:
-			output = check_output(cmd, stderr=STDOUT)
-		except CalledProcessError as e:
-			success = False
-			output = e.output
+			output = process.communicate()[0]
+		finally:
+			Ping._running.discard(process)
 
 		self.output = output.decode().strip()
-		self.success = success
+		self.returncode = process.returncode
+		self._evaluate()
+
+	def get_statistics(self):
+		"""
+		Returns a dict with the number of probes sent and received, the
+		loss percentage and the min/avg/max/mdev round trip time (ms,
+		``None`` if no probe was answered) parsed from the output.
+		"""
+		rtts = [
+			float(match.group(1)) for match in RTT_PATTERN.finditer(self.output)
+			if 'DUP!' not in self.output[match.end():].split('\n', 1)[0]
+		]
+		sent = max(self.options.get_int(self.OPTION_COUNT, 1), 1)
+		received = min(len(rtts), sent)
+		statistics = {
+			'sent': sent,
+			'received': received,
+			'loss': 100.0 * (sent - received) / sent,
+			'min': None,
+			'avg': None,
+			'max': None,
+			'mdev': None,
+		}
+		if rtts:
+			avg = sum(rtts) / len(rtts)
+			statistics.update({
+				'min': min(rtts),
+				'avg': avg,
+				'max': max(rtts),
+				'mdev': max(sum(r * r for r in rtts) / len(rtts) - avg * avg,
+							0) ** 0.5,
+			})
+		return statistics
+
+	def _evaluate(self):
+		"""
+		Evaluates the output of ping.
+		"""
+		self.success = self.returncode == 0
+		statistics = self.statistics = self.get_statistics()
+
+		self.message = "%i of %i probes answered (%.1f%% loss)" % (
+			statistics['received'], statistics['sent'], statistics['loss']
+		)
+		if statistics['avg'] is not None:
+			self.message += ", rtt min/avg/max/mdev = %s ms" % '/'.join(
+				"%.3f" % statistics[name] for name in ('min', 'avg', 'max', 'mdev')
+			)
+
+		max_loss = self.options.get(self.OPTION_MAX_LOSS)
+		if max_loss is not None and statistics['loss'] > float(max_loss):
+			self.message += "\nloss exceeds %s%%" % max_loss
+			self.success = False
+
+		max_rtt = self.options.get(self.OPTION_MAX_RTT)
+		if max_rtt is not None and (
+			statistics['avg'] is None or statistics['avg'] > float(max_rtt)
+		):
+			self.message += "\naverage rtt exceeds %s ms" % max_rtt
+			self.success = False
 
 		debug("had %ssuccess \n\n'%s'\n" % (
 			'NO ' if not self.success else '',
-			''.join([COLOR_LIGHT, self.output, COLOR_STD])
+			''.join([COLOR_LIGHT, self.message, COLOR_STD])
 		))
 
+	def start_check(self):
+		"""
+		Starts pinging in the background unless MAX_PARALLEL pings are
+		running already (do_check() will start it then), see
+		do_check_batch().
+		"""
+		if self._process is None and len(Ping._running) < self.MAX_PARALLEL:
+			self._start()
+
+	def do_check(self):
+		if self._process is None:
+			self._start()
+		self._finish()
+
+	@classmethod
+	def do_check_batch(cls, strategies, throttle=None):
+		"""
+		Pings up to MAX_PARALLEL targets at the same time, calling
+		``throttle`` (if given) before starting each ping.
+		"""
+		started = []
+		for strategy in strategies:
+			while (	strategy._process is None and started
+					and len(Ping._running) >= cls.MAX_PARALLEL ):
+				started.pop(0).do_check()
+			if throttle:
+				throttle()
+			strategy.start_check()
+			started.append(strategy)
+		for strategy in started:
+			strategy.do_check()
+
 	def get_mail_message(self):
 		return '\n'.join([
 			self.get_mail_subject(),
 			"",
+			self.message,
+			"",
 			" Output ".center(30, '-'),
 			self.output,
 			"".center(30, '-')
@@ -3,21 +3,80 @@ from smtplib import SMTP, SMTP_SSL, SMTPException
 from urllib.error import URLError
 from socket import error as SocketError
 from lib.strategies import (	BaseStrategy, DeviationCheckMixin,
+								ConnectionCheckMixin, CertificateCheckMixin,
 								KNOWLEDGE_ALIVE,
 								KNOWLEDGE_NONE )
+from lib.net import (	happy_eyeballs, ConnectionReport, get_tls_context,
+						get_tls_session, remember_tls_session,
+						get_certificate_info )
 from lib.util import (	debug,
 						COLOR_LIGHT,
 						COLOR_STD )
 
-class Smtp(BaseStrategy, DeviationCheckMixin):
+class RacingSMTP(SMTP):
+	"""
+	SMTP client which races the addresses of the host
+	(see lib.net.happy_eyeballs).
+	"""
+
+	connection_report = None
+	tls_socket = None
+	certificate_info = None
+
+	def _get_socket(self, host, port, timeout):
+		if timeout is not None and not timeout:
+			raise ValueError('Non-blocking socket (timeout=0) is not supported')
+		self.connection_report = ConnectionReport()
+		return happy_eyeballs(
+			(host, port), timeout, self.source_address, self.connection_report
+		)
+
+	def remember_tls_session(self):
+		"""
+		Remembers the TLS session (if any) for subsequent connections.
+		"""
+		if self.tls_socket is not None:
+			remember_tls_session(self.context, self._tls_key, self.tls_socket)
+
+class RacingSMTP_SSL(SMTP_SSL, RacingSMTP):
+	"""
+	SMTP_SSL client which races the addresses of the host, resumes TLS
+	sessions and collects certificate info.
+	"""
+
+	def _get_socket(self, host, port, timeout):
+		new_socket = RacingSMTP._get_socket(self, host, port, timeout)
+		self._tls_key = (host, port)
+		new_socket = self.context.wrap_socket(
+			new_socket,
+			server_hostname=host,
+			session=get_tls_session(self.context, self._tls_key),
+		)
+		self.tls_socket = new_socket
+		self.certificate_info = get_certificate_info(self._tls_key, new_socket)
+		return new_socket
+
+class Smtp(BaseStrategy, DeviationCheckMixin, ConnectionCheckMixin,
+			CertificateCheckMixin):
 
 	message = None
 	success = False
+	response_status = None
+	response_message = None
+	error = None
+
+	# attributes describing the response, see do_check_shared()
+	_shared_attributes = ('response_status', 'response_message', 'error',
+							'connection_report', 'certificate_info')
 
 	OPTION_MAX_DEVIATION = 'max_size_deviation_percentage'
 
 	_options_help = {
 		OPTION_MAX_DEVIATION: 'test fails if connect response deviates too much in size',
+		ConnectionCheckMixin.OPTION_REQUIRE_ALL_FAMILIES: ('test fails if ' +
+			'connecting via IPv4 or IPv6 fails while the other works'),
+		CertificateCheckMixin.OPTION_MIN_CERT_DAYS: ('for SMTPS targets, ' +
+			'verify the certificate and fail if it expires in less days'),
 	}
 
 	@classmethod
@@ -32,35 +91,75 @@ class Smtp(BaseStrategy, DeviationCheckMixin):
 			return KNOWLEDGE_ALIVE
 		return KNOWLEDGE_NONE
 
-	def do_check(self):
+	def get_request_key(self):
+		return (
+			self.__class__.__name__,
+			self.target.scheme.lower(),
+			self.target.netloc,
+			self.options.get('timeout'),
+			self._verify_certificate(),
+		)
+
+	def _verify_certificate(self):
 		"""
-		Method does check the server.
+		Returns whether to verify the certificate of SMTPS targets.
+		"""
+		return self.options.get(self.OPTION_MIN_CERT_DAYS) is not None
+
+	def _connect(self):
+		"""
+		Method does connect to the server and sets
+		self.{response_status, response_message, error} accordingly.
 		"""
 
 		timeout = self.options.get_int('timeout')
 		if self.target.scheme.lower().endswith('s'):
-			client = SMTP_SSL(
-				None, None, None, None, None, timeout
+			client = RacingSMTP_SSL(
+				timeout=timeout,
+				context=get_tls_context(self._verify_certificate()),
 			)
 		else:
-			client = SMTP(
+			client = RacingSMTP(
 				None, None, None, timeout
 			)
 
+		self.response_status = None
+		self.response_message = None
+		self.error = None
+
 		netloc = self.target.netloc
 		debug("opening smtp to " + netloc)
 		try:
 			response = client.connect(netloc)
-			response_status = response[0]
-			response_message = response[1]
+			self.response_status = response[0]
+			self.response_message = response[1]
+			client.remember_tls_session()
 			client.quit()
-			message = "server said: " + response_message.decode()
-			success = response_status == 220
-			self.message = message
-			self.success = success
-			self.check_deviation(response_message)
 		except (SocketError, SMTPException, ) as error:
-			self.message = str(error)
+			self.error = str(error)
+		self.connection_report = client.connection_report
+		self.certificate_info = client.certificate_info
+
+	def do_check(self):
+		"""
+		Method does check the server.
+		"""
+		self._connect()
+		self._evaluate()
+
+	def _evaluate(self):
+		"""
+		Runs all checks on the response.
+		"""
+		if self.error is None:
+			self.message = "server said: " + self.response_message.decode()
+			self.success = self.response_status == 220
+			self.check_connection()
+			if self.target.scheme.lower() == 'smtps':
+				self.check_certificate()
+			self.check_deviation(self.response_message)
+		else:
+			self.message = self.error
 			self.success = False
 
 		debug("%sreached\n\n'%s'\n" % (
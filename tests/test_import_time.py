@@ -0,0 +1,68 @@
+"""
+Regression tests for the startup time of MeerkatMon (every cron run
+imports lib.base, see README).
+"""
+
+from os.path import dirname, abspath
+from subprocess import run, PIPE
+from sys import executable
+from unittest import TestCase, main
+
+ROOT_DIRECTORY = dirname(dirname(abspath(__file__)))
+
+# cumulative import time of lib.base in microseconds
+IMPORT_TIME_BUDGET = 30000
+
+# modules only needed for some modes (mailing, HTTP checks, parallel
+# checks), which must be imported where used
+DEFERRED_MODULES = (
+	'smtplib',
+	'email',
+	'urllib.request',
+	'concurrent.futures',
+)
+
+def import_times():
+	"""
+	Imports lib.base in a fresh interpreter and returns the cumulative
+	import time (in microseconds) per imported module.
+	"""
+	process = run(
+		[executable, '-X', 'importtime', '-c', 'import lib.base'],
+		cwd=ROOT_DIRECTORY, stdout=PIPE, stderr=PIPE, check=True,
+		universal_newlines=True,
+	)
+	times = dict()
+	for line in process.stderr.splitlines():
+		if not line.startswith('import time:'):
+			continue
+		_, cumulative, module = line.split('|')
+		try:
+			times[module.strip()] = int(cumulative)
+		except ValueError:
+			# header line
+			continue
+	return times
+
+class ImportTimeTest(TestCase):
+
+	def test_import_time_within_budget(self):
+		# the fastest of some runs, to be robust against noise
+		fastest = min(import_times()['lib.base'] for _ in range(3))
+		self.assertLessEqual(
+			fastest, IMPORT_TIME_BUDGET,
+			"importing lib.base took %i us (budget: %i us)" % (
+				fastest, IMPORT_TIME_BUDGET
+			)
+		)
+
+	def test_deferred_modules_not_imported(self):
+		imported = import_times()
+		for module in DEFERRED_MODULES:
+			self.assertNotIn(
+				module, imported,
+				"'%s' is imported by lib.base, import it where used" % module
+			)
+
+if __name__ == '__main__':
+	main()